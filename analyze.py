@@ -1,189 +1,562 @@
+import hashlib
 from time import sleep
 from symbols import *
-from run import *
+from graph import *
+from build import *
+from export import *
+from edit import *
+from instrument import span, increment, traced
 
 import logging
 logger = logging.getLogger(__name__)
 
-def check_unused_import(project_path):
+WHITELIST_FILENAMES = [
+    'shiritan-Bridging-Header.h',
+    'SRTConfig.h',
+    'shiritanTests.m',
+    'shiritan_Tests.m',
+    'shiritan_UITests.m',
+]
+
+def output_progress(message):
+    # print(message, flush=True, end='')
+    print('.', flush=True, end='')
+
+class ImportValidator:
+    '''
+    Remove the candidate lines and validate them with the build backend in the git repository,
+    bisect the failed batches to isolate the lines really needed. The outcomes are remembered in
+    results_cache if given, and the candidates with unchanged inputs are not built again. The outcomes
+    of each batch are appended to the journal if given.
+    '''
+
+    def __init__(self, project_path, backend, index=None, cooldown=10, output_handler=output_progress, results_cache=None, journal=None):
+        self.project_path = project_path
+        self.backend = backend
+        self.index = index
+        self.cooldown = cooldown
+        self.output_handler = output_handler
+        self.results_cache = results_cache
+        self.journal = journal
+        self.graph = None
+        self.mischeck_count = 0
+        self.rejected = []
+
+    def validate(self, candidates, known_failed=False, full=False):
+        'Remove the candidate lines and build once, bisect the batch if failed. Return the accepted ones.'
+        if not known_failed:
+            transaction = EditTransaction()
+
+            for filepath, lineno, line in candidates:
+                transaction.remove_line(filepath, lineno, line)
+
+            applied = transaction.apply()
+
+            if len(applied) <= 0:
+                return []
+
+            logger.info(f'Validating {len(applied)} removal(s)...')
+            partial = self.backend.partial and not full
+            changed_files = sorted(set(filepath for filepath, _, _ in applied)) if partial else None
+            increment('build.runs')
+
+            with span('build'):
+                succeeded = self.backend.build(output_handler=self.output_handler, changed_files=changed_files)
+
+            if self.cooldown > 0 and not partial:
+                logger.info('Let the cpu sleep a while. :)')
+                sleep(self.cooldown)
+
+            if succeeded:
+                # Stage the accepted batch, the later commit takes the index.
+                transaction.commit()
+                run_git_stage(self.project_path, (filepath for filepath, _, _ in applied))
+                self.update_index(filepath for filepath, _, _ in applied)
+
+                for filepath, lineno, line in applied:
+                    logger.info(f'Validated successfully! Removed line {lineno + 1} "{line}" from file {filepath}.')
+
+                return applied
+
+            transaction.rollback()
+            candidates = applied
+
+        if len(candidates) == 1:
+            filepath, lineno, line = candidates[0]
+            logger.info(f'Validated failed! Revert line {lineno + 1} "{line}" from file {filepath}.')
+            self.mischeck_count += 1
+            self.rejected.append(candidates[0])
+            return []
+
+        middle = len(candidates) // 2
+        left, right = candidates[:middle], candidates[middle:]
+        accepted = self.validate(left, full=full)
+        # The whole batch failed, so the right half must fail as well once the left half passed entirely.
+        accepted += self.validate(right, known_failed=len(accepted) == len(left), full=full)
+        return accepted
+
+    def validate_batch(self, batch):
+        'Validate the batch, confirm the results of a partial backend with a full build.'
+        if not self.backend.partial:
+            return self.validate(batch)
+
+        snapshot, mischeck_count, rejected_count = EditTransaction(), self.mischeck_count, len(self.rejected)
+
+        for filepath in set(filepath for filepath, _, _ in batch):
+            snapshot.capture(filepath)
+
+        accepted = self.validate(batch)
+
+        if len(accepted) <= 0:
+            return accepted
+
+        increment('build.runs')
+
+        with span('build'):
+            succeeded = self.backend.build(output_handler=self.output_handler)
+
+        if succeeded:
+            return accepted
+
+        logger.warning('Full build failed at the batch boundary, validating the batch with full builds again.')
+
+        filepaths = list(snapshot.originals)
+        snapshot.rollback()
+        self.update_index(filepaths)
+        run_git_stage(self.project_path, filepaths)
+        self.mischeck_count = mischeck_count
+        del self.rejected[rejected_count:]
+        return self.validate(batch, full=True)
+
+    def validate_all(self, candidates, batch_size=32):
+        'Validate all the candidates in batches, return the accepted ones.'
+        accepted, pending = [], candidates
+
+        if self.results_cache is not None:
+            keys = {candidate: self.get_result_key(*candidate) for candidate in candidates}
+            pending, cached, skipped = [], [], []
+
+            for candidate in candidates:
+                result = self.results_cache.get(keys[candidate])
+
+                if result is None:
+                    pending.append(candidate)
+                elif result:
+                    cached.append(candidate)
+                else:
+                    logger.info(f'Skipped line {candidate[1] + 1} "{candidate[2]}" from file {candidate[0]}, it failed before with the same inputs.')
+                    skipped.append(candidate)
+
+            accepted = remove_lines(cached)
+
+            if len(accepted) > 0:
+                run_git_stage(self.project_path, (filepath for filepath, _, _ in accepted))
+                self.update_index(filepath for filepath, _, _ in accepted)
+                logger.info(f'Accepted {len(accepted)} removal(s) validated before with the same inputs.')
+
+            self.record(accepted, True, cached=True)
+            self.record(skipped, False, cached=True)
+
+        for start in range(0, len(pending), batch_size):
+            rejected_count = len(self.rejected)
+            validated = self.validate_batch(pending[start:start + batch_size])
+            accepted += validated
+
+            if self.results_cache is not None:
+                for candidate in validated:
+                    self.results_cache.put(keys[candidate], True)
+
+                for candidate in self.rejected[rejected_count:]:
+                    self.results_cache.put(keys[candidate], False)
+
+                self.results_cache.save()
+
+            self.record(validated, True)
+            self.record(self.rejected[rejected_count:], False)
+
+        return accepted
+
+    def record(self, candidates, accepted, **fields):
+        'Append the outcomes of the candidates to the journal.'
+        if self.journal is None:
+            return
+
+        for filepath, lineno, line in candidates:
+            self.journal.record('candidate', file=os.path.relpath(filepath, self.project_path), lineno=lineno, line=line, accepted=accepted, **fields)
+
+    def get_result_key(self, filepath, lineno, line):
+        'Return the content-addressed key of removing the line at the line number from the file.'
+        if self.graph is None:
+            self.graph = HeaderGraph().add_project_headers(self.project_path)
+
+        dependencies = self.graph.get_dependencies(filepath)
+        return self.results_cache.get_key(self.project_path, filepath, lineno, line, dependencies)
+
+    def update_index(self, filepaths):
+        for filepath in set(filepaths):
+            self.index is not None and self.index.update_file(filepath)
+            self.graph is not None and self.graph.invalidate(filepath)
+
+def get_unused_import_candidates(symbol, project_path, index=None):
+    '''
+    Return the (filepath, line number, line) of the import lines which are the only usages of the symbol
+    in the files, the comments mentioning the symbol are kept.
+    '''
+    candidates = []
+
+    for filepath, usages in search_unused_symbol_usages(symbol, project_path, index=index):
+        _, filename = os.path.split(filepath)
+
+        if filename in WHITELIST_FILENAMES:
+            continue
+
+        results = [(lineno, line) for lineno, line, kinds in usages if is_code_import(kinds)]
+
+        if len(results) <= 0:
+            continue
+
+        logger.info(f'{symbol} is unused in file {filepath}!')
+
+        for lineno, line in results:
+            logger.info(f'\n{line}')
+            candidates.append((filepath, lineno, line))
+
+    return candidates
+
+def commit_pending_changes(project_path):
+    'Commit all the changes left in the git repository.'
+    changes = run_git_status(project_path)
+
+    if changes and len(changes) > 0:
+        run_git_add_all(project_path) and run_git_commit(project_path)
+
+def reconcile_interrupted_run(project_path, backend, message):
+    '''
+    Revert the unvalidated edits left by the interrupted run, commit the staged (validated) ones
+    only if they still build.
+    '''
+    if not run_git_status(project_path):
+        return
+
+    logger.info('Reconciling the changes left by the interrupted run.')
+    run_git_discard(project_path)
+
+    if not run_git_status(project_path):
+        return
+
+    if backend.build(output_handler=output_progress):
+        run_git_add_all(project_path) and run_git_commit(project_path, message)
+    else:
+        logger.warning('The staged changes left by the interrupted run break the build, reverting them.')
+        run_git_reset_hard(project_path)
+
+def resume_journal(journal, project_path, backend):
+    'Reconcile the project with the journal, return the completed symbols to skip.'
+    completed = journal.get_completed_symbols()
+    interrupted = journal.get_interrupted_symbols()
+
+    if completed or interrupted:
+        accepted_count, rejected_count = journal.get_counts()
+        logger.info(f'Resuming after {len(completed)} symbol(s), {accepted_count} accepted and {rejected_count} rejected so far.')
+
+    if interrupted:
+        reconcile_interrupted_run(project_path, backend, f'{", ".join(interrupted)} usages.')
+
+    journal.record('start', head=run_git_head(project_path))
+    return completed
+
+@traced('analyze.check_unused_imports')
+def check_unused_import(project_path, cache=None, jobs=1, batch_size=32, backend=None, cooldown=10, results_cache=None, journal=None):
     '''
     Analyze all the header imports is necessary or not, remove the unused ones with git-commit
-    after validating via xcodebuild.
+    after validating via the build backend, an incremental xcodebuild of the project workspace by default.
+
+    The candidate lines of each symbol are removed and validated in batches of batch_size,
+    a failed batch is bisected to isolate the lines really needed, batch_size=1 validates
+    the candidates one by one. A partial backend validates the affected files only, and each
+    batch is confirmed with a full build. Each symbol and candidate outcome is appended to the journal
+    if given, the symbols completed in the journal are skipped.
     '''
-    workspace = find_xcode_workspace(project_path)
-    _, workspace_name = os.path.split(workspace)
-    # Take the workspace prefix as default scheme name
-    scheme, _ = os.path.splitext(workspace_name)
+    backend = backend or XcodeBuildBackend.from_project(project_path)
 
-    def output(message):
-        # print(message, flush=True, end='')
-        print('.', flush=True, end='')
+    if backend is None:
+        logger.error(f'No xcode workspace found in {project_path}, specify a build backend instead.')
+        return
+
+    completed = resume_journal(journal, project_path, backend) if journal else set()
 
     logger.info('Validating project environment before checking.')
 
-    if not run_xcode_build(workspace, scheme, output_handler=output):
+    if not backend.build(output_handler=output_progress):
         logger.error(f'Make sure the project {project_path} could build successfully before validating!')
         return
 
-    whitelist_filenames = [
-        'shiritan-Bridging-Header.h',
-        'SRTConfig.h',
-        'shiritanTests.m',
-        'shiritan_Tests.m',
-        'shiritan_UITests.m',
-    ]
-
-    all_symbols = get_all_classes(project_path)
-    unused_count, mischeck_count = 0, 0
+    # The validator stages or restores all the files it touches, nothing is left pending between the symbols.
+    commit_pending_changes(project_path)
+    index = SymbolIndex(project_path, cache=cache, jobs=jobs).build()
+    all_symbols = index.get_all_classes()
+    validator = ImportValidator(project_path, backend, index=index, cooldown=cooldown, results_cache=results_cache, journal=journal)
+    unused_count = 0
 
     for idx in range(len(all_symbols)):
         symbol = all_symbols[idx]
+
+        if symbol in completed:
+            continue
+
         logger.info(f'Analyzing {symbol} ({idx}/{len(all_symbols)})')
-        found_unused = False
+        journal and journal.record('symbol', symbol=symbol, index=idx)
+        candidates = get_unused_import_candidates(symbol, project_path, index=index)
+        accepted = validator.validate_all(candidates, batch_size=batch_size)
 
-        changes = run_git_status(project_path)
+        if len(accepted) > 0:
+            unused_count += len(accepted)
+            run_git_commit(project_path, f'{symbol} usages.')
 
-        if changes and len(changes) > 0:
-            run_git_add_all(project_path) and run_git_commit(project_path)
+        journal and journal.record('done', symbol=symbol, accepted=len(accepted))
 
-        for filepath, results in get_unused_symbol_code_import(symbol, project_path):
-            _, filename = os.path.split(filepath)
+    logger.info(f'Removed unused {unused_count} change(s), mischeck {validator.mischeck_count}')
 
-            if filename in whitelist_filenames:
-                continue
+@traced('analyze.check_unused_imports')
+def check_unused_import_parallel(project_path, backend_factory, workers=4, cache=None, jobs=1, batch_size=32, cooldown=10, worktrees_dir=None, results_cache=None, journal=None):
+    '''
+    Validate the candidates of different symbols concurrently, each worker builds in its own git worktree
+    created from backend_factory(worktree_path). The accepted removals are replayed and committed in the
+    project's checkout, which is confirmed with a full build at last.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    from queue import Queue
+    from threading import Lock
 
-            if symbol in filepath:
-                # Skip the symbol file itself.
-                continue
+    project_path = os.path.abspath(os.path.expanduser(project_path))
+    completed = resume_journal(journal, project_path, backend_factory(project_path)) if journal else set()
+    commit_pending_changes(project_path)
 
-            is_unused = True
+    index = SymbolIndex(project_path, cache=cache, jobs=jobs).build()
+    all_symbols = index.get_all_classes()
 
-            for result in results:
-                is_unused &= is_code_import(result)# or is_code_single_line_comment(result)
+    # Keep the worktrees for the following runs, their build products make the builds incremental.
+    name = hashlib.sha1(project_path.encode('utf-8')).hexdigest()
+    worktrees_dir = worktrees_dir or os.path.join(OUTPUT_DIR, 'worktrees', name)
+    worktrees, head = Queue(), run_git_head(project_path)
 
-            if not is_unused:
-                continue
+    for i in range(workers):
+        worktree = os.path.join(worktrees_dir, str(i))
 
-            logger.info(f'{symbol} is unused in file {filepath}!')
+        if os.path.exists(os.path.join(worktree, '.git')):
+            run_git_worktree_reset(worktree, head)
+        elif not run_git_worktree_add(project_path, worktree, head):
+            return
 
-            for r in results:
-                logger.info(f'\n{r}')
+        backend = backend_factory(worktree)
+        logger.info(f'Validating worktree {worktree} before checking.')
 
-                if remove_line_from_file(filepath, r):
-                    logger.info('Validating...')
+        if not backend.build(output_handler=output_progress):
+            logger.error(f'Make sure the project {worktree} could build successfully before validating!')
+            return
 
-                    if run_xcode_build(workspace, scheme, output_handler=output):
-                        run_git_add_all(project_path)
-                        logger.info(f'Validated successfully! Removed line "{r}" from file {filepath}.')
-                        found_unused = True
-                        unused_count += 1
-                    else:
-                        run_git_discard(project_path)
-                        logger.info(f'Validated failed! Revert line "{r}" from file {filepath}.')
-                        mischeck_count += 1
+        worktrees.put(ImportValidator(worktree, backend, cooldown=cooldown, results_cache=results_cache, journal=journal))
 
-                    logger.info('Let the cpu sleep a while. :)')
-                    sleep(10)
+    validators = list(worktrees.queue)
+    lock = Lock()
+    counts = {'unused': 0}
 
-        if found_unused:
-            run_git_commit(project_path, f'{symbol} usages.')
+    def check_symbol(symbol):
+        if symbol in completed:
+            return
 
-    logger.info(f'Removed unused {unused_count} change(s), mischeck {mischeck_count}')
+        journal and journal.record('symbol', symbol=symbol)
 
-def generate_header_tree(project_path, root_header, show_raw_graph=True, dotfile=None):
-    '''
-    Generate the import header tree graph for the project.
-    '''
+        # Take the candidates from the project checkout, it is updated only with the lock held.
+        with lock:
+            candidates = get_unused_import_candidates(symbol, project_path, index=index)
+            head = run_git_head(project_path)
 
-    class HeaderNode:
-        all_nodes = []
+        if len(candidates) <= 0:
+            journal and journal.record('done', symbol=symbol, accepted=0)
+            return
 
-        def __init__(self, name, dir=None, module=None, source=None):
-            self.name = name        # header filename.
-            self.dir = dir          # header file's parent path.
-            self.module = module    # framework name if exists.
-            self.source = source    # reference header file path.
-            self.import_paths = []  # all the headers imported in current header.
+        validator = worktrees.get()
+        worktree = validator.project_path
 
-        def __repr__(self):
-            return f'<Node: {self.name} {self.dir or ""} {self.source and self.source.name or ""}>'
+        try:
+            run_git_worktree_reset(worktree, head)
+            relocated = [(os.path.join(worktree, os.path.relpath(filepath, project_path)), lineno, line) for filepath, lineno, line in candidates]
+            accepted = validator.validate_all(relocated, batch_size=batch_size)
+        finally:
+            worktrees.put(validator)
 
-        @property
-        def fullpath(self):
-            return os.path.join(self.dir, self.name) if self.dir else None
+        with lock:
+            if len(accepted) > 0:
+                # The line numbers come from the same checkout, the nearest lines are taken if the merged removals shifted them.
+                merged = set(filepath for filepath, _, _ in remove_lines((os.path.join(project_path, os.path.relpath(filepath, worktree)), lineno, line) for filepath, lineno, line in accepted))
 
-        def save(self):
-            self.__class__.all_nodes.append(self)
+                for filepath in merged:
+                    index.update_file(filepath)
 
-        @classmethod
-        def find_by_name(cls, name, dir=None):
-            nodes = list(filter(lambda x: x.name == name and (dir is None or x.dir == dir), cls.all_nodes))
-            return nodes[0] if len(nodes) > 0 else None
+                run_git_stage(project_path, merged) and run_git_commit(project_path, f'{symbol} usages.')
+                counts['unused'] += len(accepted)
+                logger.info(f'Merged {len(accepted)} removal(s) of {symbol} from worktree {worktree}.')
 
-        @classmethod
-        def get_or_create(cls, name, dir=None):
-            node = cls.find_by_name(name, dir)
+            journal and journal.record('done', symbol=symbol, accepted=len(accepted))
 
-            if node:
-                return False, node
-            else:
-                return True, HeaderNode(name, dir=dir)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for idx, _ in enumerate(executor.map(check_symbol, all_symbols)):
+            logger.info(f'Analyzed {all_symbols[idx]} ({idx}/{len(all_symbols)})')
 
-    all_headers = find_source_files(project_path, extensions=[], dir_filter=lambda dirname, dirpath: dirname not in ['lib', 'grpc', 'UBC'])
+    mischeck_count = sum(validator.mischeck_count for validator in validators)
+    logger.info(f'Removed unused {counts["unused"]} change(s), mischeck {mischeck_count}')
 
-    # First, generate header nodes.
-    for root, name in all_headers:
-        created, node = HeaderNode.get_or_create(name, dir=root)
+    # The removals are validated separately, make sure they still build together.
+    if counts['unused'] > 0 and not backend_factory(project_path).build(output_handler=output_progress):
+        logger.error(f'The merged removals break the build of {project_path}, bisect the "usages." commits to find the culprits.')
 
-        if created:
-            node.save()
-        else:
-            logger.warn(f'Found duplicated header file {name}')
+def build_header_graph(project_path, root_header, cache=None, compact=None):
+    'Return the header graph of the project and the node of the root header to walk from.'
+    graph = HeaderGraph(cache=cache, compact=compact)
 
-    logger.debug(f'Total headers: {len(HeaderNode.all_nodes)}')
+    # First, generate header nodes.
+    graph.add_project_headers(project_path, dir_filter=lambda dirname, dirpath: dirname not in ['lib', 'grpc', 'UBC'])
+    logger.debug(f'Total headers: {len(graph)}')
 
-    if dotfile:
-        import pygraphviz as pgv
-        tree = pgv.AGraph(rankdir='LR')
+    # Second, start scanning from the specified root header.
+    _, root_node = graph.get_or_create(os.path.basename(root_header), dir=os.path.dirname(root_header))
+    return graph, root_node
 
-    def analyze_header(node, depth=0):
-        if show_raw_graph:
-            print(f'{"    " * depth}{node.name}')
+def iter_header_import_records(project_path, root_header, show_cycles=False, cache=None, compact=None):
+    'Yield the records of the import edges as they are discovered from the root header, then the import cycles if show_cycles.'
+    graph, root_node = build_header_graph(project_path, root_header, cache=cache, compact=compact)
+    edges = []
 
-        node.analyzed = True
+    for depth, node, sub_node in graph.walk(root_node):
+        if node:
+            show_cycles and edges.append((node, sub_node))
+            yield {'kind': 'header_import', 'file': node.fullpath, 'symbol': sub_node.name, 'depth': depth}
 
-        for header in get_all_header_imports(node.fullpath):
-            created, sub_node = HeaderNode.get_or_create(header)
-            sub_node.source = node
+    for cycle in find_cycles(edges) if show_cycles else []:
+        yield {'kind': 'import_cycle', 'files': sorted(node.fullpath for node in cycle)}
 
-            if created:
-                sub_node.save()
-                # Skip the new incoming header files.
-                continue
+@traced('analyze.header_tree')
+def generate_header_tree(project_path, root_header, show_raw_graph=True, output_file=None, format=None, reduce=False, show_cycles=False, cache=None, compact=None):
+    '''
+    Generate the import header tree graph for the project.
+    '''
+    graph, root_node = build_header_graph(project_path, root_header, cache=cache, compact=compact)
+    edges = []  # kept only for the reduction and the cycles.
 
-            if sub_node.fullpath is None:
-                # Skip the external header files.
-                continue
+    def discover():
+        for depth, node, sub_node in graph.walk(root_node):
+            if show_raw_graph:
+                print(f'{"    " * depth}{sub_node.name}')
 
-            path = node.fullpath
+            if node:
+                (reduce or show_cycles) and edges.append((node, sub_node))
+                yield node, sub_node
 
-            if path in sub_node.import_paths:
-                continue
+    # Finally, stream the edges to the graph file as they are discovered, unless the reduction needs all of them.
+    if output_file and not reduce:
+        count = write_graph(output_file, ((node.name, sub_node.name) for node, sub_node in discover()), format=format)
+        logger.debug(f'Wrote {count} edge(s) to {output_file}')
+    else:
+        for _ in discover():
+            pass
 
-            sub_node.import_paths.append(path)
-            sub_node.save()
+    if output_file and reduce:
+        reduced_edges = reduce_transitive_edges(edges)
+        logger.debug(f'Reduced {len(edges)} edge(s) to {len(reduced_edges)}')
+        write_graph(output_file, ((node.name, sub_node.name) for node, sub_node in reduced_edges), format=format)
 
-            if dotfile:
-                tree.add_edge(node.name, sub_node.name)
+    if show_cycles:
+        cycles = find_cycles(edges)
 
-            # Third, loop into to build the source relationship.
-            analyze_header(sub_node, depth + 1)
+        for cycle in cycles:
+            print(f'Import cycle of {len(cycle)} header(s): {", ".join(sorted(node.name for node in cycle))}')
 
-    # Second, start scanning from the specified root header.
-    root_node = HeaderNode(os.path.basename(root_header), dir=os.path.dirname(root_header))
-    root_node.save()
-    analyze_header(root_node)
+        print(f'Total import cycles: {len(cycles)}')
+
+    return graph
 
-    # Finally, generate tree with graphviz if necessary.
-    if dotfile:
-        tree.write(dotfile)
+class IncludeCost:
+    '''
+    The preprocessing cost of one header or translation unit, the transitive counts include the file itself.
+    '''
+    __slots__ = ('path', 'bytes', 'lines', 'headers', 'transitive_bytes', 'transitive_lines', 'fan_in')
+
+    def __init__(self, path, bytes, lines, headers, transitive_bytes, transitive_lines, fan_in=0):
+        self.path = path
+        self.bytes = bytes
+        self.lines = lines
+        self.headers = headers      # count of the headers imported directly or transitively.
+        self.transitive_bytes = transitive_bytes
+        self.transitive_lines = transitive_lines
+        self.fan_in = fan_in        # count of the translation units importing it directly or transitively.
+
+    @property
+    def cost(self):
+        'The lines preprocessed on behalf of the header in all the translation units, the most removing or forward-declaring it could save.'
+        return self.fan_in * self.transitive_lines
+
+@traced('analyze.include_costs')
+def get_include_costs(project_path, cache=None, jobs=1, compact=None):
+    '''
+    Return the include costs of all the headers (ranked by cost) and all the translation units
+    (ranked by transitive lines) in the project.
+    '''
+    graph = HeaderGraph(cache=cache, compact=compact).add_project_headers(project_path)
+    units = [graph.add_file(os.path.join(dirpath, filename))[1] for dirpath, filename in find_source_files(project_path, include_headers=False)]
+    headers = [node for nodes in graph.names.values() for node in nodes if node.fullpath and node.name.endswith('.h')]
+    logger.debug(f'Total headers: {len(headers)}, units: {len(units)}')
+
+    ordered, closures = graph.get_closures(units + headers)
+    bits = {node.key: index for index, node in enumerate(ordered)}
+    sizes = list(map_files(get_file_size, [node.fullpath for node in ordered], jobs=jobs))
+    fan_ins = [0] * len(ordered)
+
+    totals = {}     # bitset -> (indexes, bytes, lines), the members of the same component share one closure.
+
+    def get_totals(bitset):
+        if bitset not in totals:
+            indexes = list(iter_bits(bitset))
+            totals[bitset] = indexes, sum(sizes[index][0] for index in indexes), sum(sizes[index][1] for index in indexes)
+
+        return totals[bitset]
+
+    unit_costs = []
+    unit_counts = {}    # imported bitset -> count of the units importing exactly these headers.
+
+    for node in units:
+        bit = bits[node.key]
+        imported = closures[node.key] & ~(1 << bit)
+        indexes, imported_bytes, imported_lines = get_totals(imported)
+        bytes, lines = sizes[bit]
+        unit_costs.append(IncludeCost(node.fullpath, bytes, lines, len(indexes), bytes + imported_bytes, lines + imported_lines))
+        unit_counts[imported] = unit_counts.get(imported, 0) + 1
+
+    for imported, count in unit_counts.items():
+        for index in totals[imported][0]:
+            fan_ins[index] += count
+
+    header_costs = []
+
+    for node in headers:
+        bit = bits[node.key]
+        indexes, transitive_bytes, transitive_lines = get_totals(closures[node.key])
+        bytes, lines = sizes[bit]
+        header_costs.append(IncludeCost(node.fullpath, bytes, lines, len(indexes) - 1, transitive_bytes, transitive_lines, fan_ins[bit]))
+
+    header_costs.sort(key=lambda cost: (-cost.cost, cost.path))
+    unit_costs.sort(key=lambda cost: (-cost.transitive_lines, cost.path))
+    return header_costs, unit_costs
+
+@traced('analyze.dead_classes')
+def find_dead_classes(project_path, roots=None, jobs=1):
+    '''
+    Return the classes unreachable from the app delegates, the classes referenced by the storyboards
+    and xibs, the source files without any class and the specified root class names.
+    '''
+    graph = ClassGraph().build(project_path, jobs=jobs)
+    graph.add_app_delegate_roots()
+    graph.add_interface_builder_roots(project_path)
+    graph.add_roots(roots or [], 'whitelist')
+    logger.debug(f'Total classes: {len(graph.files)}, roots: {len(graph.roots)}')
+    return graph.get_dead_classes()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+import os, os.path
+import sys
+import json
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+from time import perf_counter
+import click
+from synthetic import PREFIX_HEADER, SyntheticProject
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_SCRIPT = os.path.join(ROOT_DIR, 'main.py')
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), 'code-analyzer-bench')
+BENCH_VERSION = 1
+DEFAULT_SCALES = [1000, 10000, 100000]
+# The generated commit, the mutating cases are reset to it.
+INITIAL_REF = 'refs/bench/initial'
+# The timings shorter than this are dominated by the noise, never flag their ratios.
+MIN_SECONDS = 0.05
+
+class BenchCase:
+    '''
+    One benchmarked command, each repeat runs in a new process so its wall time and peak RSS are its own.
+    The function cases call the core functions directly, the CLI cases run main.py without the daemon and cache.
+    The mutating cases get the project reset to its initial commit before each repeat.
+    '''
+
+    def __init__(self, name, code=None, command=None, max_scale=None, mutates=False):
+        self.name = name
+        self.code = code
+        self.command = command
+        self.max_scale = max_scale
+        self.mutates = mutates
+
+    def __repr__(self):
+        return f'<BenchCase: {self.name}>'
+
+    def get_args(self, project_path):
+        if self.code is not None:
+            return [sys.executable, '-c', self.code, project_path]
+
+        return [sys.executable, MAIN_SCRIPT, '--no-daemon', '--no-cache', *(arg.format(project=project_path) for arg in self.command)]
+
+BENCH_CASES = [
+    BenchCase('get_all_view_controllers', code='import sys; from symbols import get_all_view_controllers; get_all_view_controllers(sys.argv[1])'),
+    BenchCase('get_all_unused_code_import', code='import sys; from symbols import get_all_unused_code_import; list(get_all_unused_code_import(sys.argv[1]))'),
+    BenchCase('generate_header_tree', code=f'import sys, os.path; from analyze import generate_header_tree; generate_header_tree(sys.argv[1], os.path.join(sys.argv[1], "{PREFIX_HEADER}"), show_raw_graph=False)'),
+    BenchCase('cli:get-all-vcs', command=['get-all-vcs', '{project}']),
+    BenchCase('cli:analyze-unused-symbols', command=['analyze-unused-symbols', '{project}']),
+    BenchCase('cli:generate-header-graph', command=['generate-header-graph', '--hide-raw-result', '--cycles', '{project}', os.path.join('{project}', PREFIX_HEADER)]),
+    BenchCase('cli:include-cost', command=['include-cost', '{project}']),
+    BenchCase('cli:find-dead-classes', command=['find-dead-classes', '{project}']),
+    # The validation path with a stub build, every removal is accepted and committed.
+    BenchCase('cli:check-unused-imports', command=['check-unused-imports', '--build-command', 'true', '--cooldown', '0', '--no-reuse-results', '{project}'], max_scale=10000, mutates=True),
+]
+
+def measure(args, cwd=None, log_dir=None):
+    '''
+    Run the command, return its wall seconds and peak RSS in KiB (ru_maxrss is in KiB on Linux).
+    The logs, caches and journals of the command go to the log_dir, off the package directory.
+    '''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get('PYTHONPATH')])))
+    log_dir and env.update(ANALYZER_LOG_DIR=log_dir)
+
+    with tempfile.TemporaryFile() as ferr:
+        start = perf_counter()
+        p = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=ferr)
+        # Reap the process via wait4 to take the resource usage of this child only.
+        _, status, usage = os.wait4(p.pid, 0)
+        seconds = perf_counter() - start
+        p.returncode = os.waitstatus_to_exitcode(status)
+
+        if p.returncode != 0:
+            ferr.seek(0)
+            error = ferr.read().decode('utf-8', 'replace')[-2000:]
+            raise click.ClickException(f'Command {" ".join(args)} exited with {p.returncode}:\n{error}')
+
+    return seconds, usage.ru_maxrss
+
+def prepare_project(work_dir, scale, seed):
+    'Generate the project of the scale once, the generator is deterministic so it is reused by the later runs.'
+    path = os.path.join(work_dir, f'objc-{scale}-s{seed}')
+
+    if not os.path.exists(os.path.join(path, '.git')):
+        click.echo(f'Generating {scale} files into {path}...', err=True)
+        SyntheticProject(files=scale, seed=seed).write(path, git=True)
+        subprocess.run(['git', 'update-ref', INITIAL_REF, 'HEAD'], cwd=path, check=True)
+
+    return path
+
+def reset_project(path):
+    'Drop all the changes and commits made by the mutating cases.'
+    subprocess.run(['git', 'reset', '-q', '--hard', INITIAL_REF], cwd=path, check=True)
+    subprocess.run(['git', 'clean', '-q', '-f', '-d'], cwd=path, check=True)
+
+def run_benchmarks(cases, scales, repeat=3, work_dir=None, seed=0):
+    'Return the results of all the cases at all the scales, the minimal wall time and maximal peak RSS of the repeats.'
+    work_dir = work_dir or DEFAULT_WORK_DIR
+    results = {}
+
+    for scale in scales:
+        project_path = prepare_project(work_dir, scale, seed)
+
+        for case in cases:
+            if case.max_scale is not None and scale > case.max_scale:
+                continue
+
+            runs = []
+
+            for _ in range(repeat):
+                case.mutates and reset_project(project_path)
+                runs.append(measure(case.get_args(project_path), cwd=project_path, log_dir=os.path.join(work_dir, 'logs')))
+
+            case.mutates and reset_project(project_path)
+            key = f'{case.name}@{scale}'
+            results[key] = {
+                'case': case.name,
+                'scale': scale,
+                'wall_seconds': round(min(seconds for seconds, _ in runs), 4),
+                'runs': [round(seconds, 4) for seconds, _ in runs],
+                'peak_rss_kb': max(rss for _, rss in runs),
+            }
+            click.echo(f'{key}\t{results[key]["wall_seconds"]:.3f}s\t{results[key]["peak_rss_kb"] // 1024} MiB', err=True)
+
+    return {
+        'version': BENCH_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+def compare_results(baseline, current, threshold=0.1, rss_threshold=0.1):
+    '''
+    Return the (key, metric, baseline value, current value, ratio) of the regressions, the current values
+    exceeding the baseline ones by more than the thresholds. The keys missing in either side are skipped.
+    '''
+    regressions = []
+
+    for key, result in sorted(current['results'].items()):
+        base = baseline['results'].get(key)
+
+        if base is None:
+            continue
+
+        for metric, limit in (('wall_seconds', threshold), ('peak_rss_kb', rss_threshold)):
+            old, new = base[metric], result[metric]
+
+            if metric == 'wall_seconds' and max(old, new) < MIN_SECONDS:
+                continue
+
+            ratio = new / old if old else float('inf')
+
+            if ratio > 1 + limit:
+                regressions.append((key, metric, old, new, ratio))
+
+    return regressions
+
+def load_results(path):
+    with open(path, 'r') as f:
+        payload = json.load(f)
+
+    if payload.get('version') != BENCH_VERSION:
+        raise click.ClickException(f'Unsupported benchmark results version in {path}.')
+
+    return payload
+
+def report_comparison(baseline, current, threshold, rss_threshold):
+    'Print the changes of all the shared keys, return the regressions.'
+    for key, result in sorted(current['results'].items()):
+        base = baseline['results'].get(key)
+        base and print(f'{key}\t{base["wall_seconds"]:.3f}s -> {result["wall_seconds"]:.3f}s\t{base["peak_rss_kb"] // 1024} -> {result["peak_rss_kb"] // 1024} MiB')
+
+    regressions = compare_results(baseline, current, threshold=threshold, rss_threshold=rss_threshold)
+
+    for key, metric, old, new, ratio in regressions:
+        print(f'REGRESSION {key} {metric}: {old} -> {new} ({ratio:.2f}x)')
+
+    return regressions
+
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.argument('path', type=click.Path(file_okay=False))
+@click.option('--files', type=click.IntRange(min=2), default=1000, show_default=True, help='Number of the source files, half headers and half implementations.')
+@click.option('--fanout', type=click.IntRange(min=0), default=4, show_default=True, help='Number of the headers each file imports.')
+@click.option('--depth', type=click.IntRange(min=1), default=8, show_default=True, help='Number of the header import layers.')
+@click.option('--cycles', type=click.IntRange(min=0), default=4, show_default=True, help='Number of the back edges closing the import cycles.')
+@click.option('--large-files', type=click.IntRange(min=0), default=2, show_default=True, help='Number of the large generated implementations.')
+@click.option('--large-lines', type=click.IntRange(min=0), default=20000, show_default=True, help='Lines of each large generated implementation.')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--git/--no-git', default=True, help='Commit the project into a new git repository or not.')
+def generate(path, files, fanout, depth, cycles, large_files, large_lines, seed, git):
+    '''
+    Generate a deterministic synthetic Objective-C project.
+    '''
+    SyntheticProject(files=files, fanout=fanout, depth=depth, cycles=cycles, large_files=large_files, large_lines=large_lines, seed=seed).write(path, git=git)
+
+@cli.command()
+@click.option('--scale', 'scales', type=click.IntRange(min=2), multiple=True, help=f'Number of the files of the project, could be specified multiple times. [default: {", ".join(map(str, DEFAULT_SCALES))}]')
+@click.option('--case', 'case_names', type=click.Choice([case.name for case in BENCH_CASES]), multiple=True, help='Case to run, could be specified multiple times. [default: all]')
+@click.option('--repeat', type=click.IntRange(min=1), default=3, show_default=True, help='Runs of each case, the fastest one is taken.')
+@click.option('--work-dir', type=click.Path(file_okay=False), default=None, help='Directory of the generated projects, reused between the runs.')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write the JSON results to the file, e.g. as the new baseline. [default: results/ of the work directory]')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False), default=None, help='Compare the results with the baseline file, exit with 1 on any regression.')
+@click.option('--threshold', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Tolerated slowdown ratio of the wall time.')
+@click.option('--rss-threshold', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Tolerated growth ratio of the peak RSS.')
+def run(scales, case_names, repeat, work_dir, seed, output, baseline_path, threshold, rss_threshold):
+    '''
+    Run the benchmark cases at the scales, record the wall time and peak RSS.
+    '''
+    cases = [case for case in BENCH_CASES if not case_names or case.name in case_names]
+    results = run_benchmarks(cases, scales or DEFAULT_SCALES, repeat=repeat, work_dir=work_dir, seed=seed)
+    output = output or os.path.join(work_dir or DEFAULT_WORK_DIR, 'results', f'bench-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    click.echo(f'Wrote the results to {output}', err=True)
+
+    if baseline_path and report_comparison(load_results(baseline_path), results, threshold, rss_threshold):
+        sys.exit(1)
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Tolerated slowdown ratio of the wall time.')
+@click.option('--rss-threshold', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Tolerated growth ratio of the peak RSS.')
+def compare(baseline, current, threshold, rss_threshold):
+    '''
+    Compare two benchmark results, exit with 1 on any regression.
+    '''
+    if report_comparison(load_results(baseline), load_results(current), threshold, rss_threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
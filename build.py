@@ -0,0 +1,207 @@
+import re
+import json
+import shlex
+import subprocess
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from files import find_xcode_workspace
+from graph import HeaderGraph
+from run import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+class BuildBackend(ABC):
+    '''
+    Build the project to validate the changes, subclasses implement build().
+    A partial backend checks only the units affected by changed_files, callers should
+    confirm its results with a full build (changed_files=None) at the batch boundaries.
+    '''
+    partial = False
+
+    @abstractmethod
+    def build(self, output_handler=None, changed_files=None):
+        'Return True if the project builds successfully.'
+
+class XcodeBuildBackend(BuildBackend):
+    '''
+    Build the workspace scheme via xcodebuild, the incremental mode never cleans the build products.
+    The build is killed on the first output line matching abort_regex (the first compile error by default).
+    '''
+
+    def __init__(self, workspace, scheme, incremental=True, quiet_mode=False, abort_regex=XCODE_ERROR_REGEX, timeout=None):
+        self.workspace = workspace
+        self.scheme = scheme
+        self.incremental = incremental
+        self.quiet_mode = quiet_mode
+        self.abort_regex = abort_regex
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f'<XcodeBuildBackend: {self.workspace} {self.scheme} {"incremental" if self.incremental else "clean"}>'
+
+    @classmethod
+    def from_project(cls, project_path, incremental=True, **kwargs):
+        'Take the first workspace in the project and its prefix as the default scheme name.'
+        workspace = find_xcode_workspace(project_path)
+
+        if workspace is None:
+            return None
+
+        _, workspace_name = os.path.split(workspace)
+        scheme, _ = os.path.splitext(workspace_name)
+        return cls(workspace, scheme, incremental=incremental, **kwargs)
+
+    def build(self, output_handler=None, changed_files=None):
+        return run_xcode_build(self.workspace, self.scheme, quiet_mode=self.quiet_mode, output_handler=output_handler, clean=not self.incremental, abort_regex=self.abort_regex, timeout=self.timeout)
+
+class CommandBuildBackend(BuildBackend):
+    '''
+    Build via any shell command like `make`, it succeeds when the command exits with 0,
+    the success_regex (if any) matches one output line and the failure_regex (if any) matches none.
+    The command is killed on the first failure_regex match, if abort_on_failure, or after the timeout.
+    '''
+
+    def __init__(self, command, cwd=None, success_regex=None, failure_regex=None, abort_on_failure=True, timeout=None):
+        self.command = command
+        self.cwd = cwd
+        self.success_regex = re.compile(success_regex) if success_regex else None
+        self.failure_regex = re.compile(failure_regex) if failure_regex else None
+        self.abort_on_failure = abort_on_failure
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f'<CommandBuildBackend: {self.command}>'
+
+    def build(self, output_handler=None, changed_files=None):
+        matched = {'success': False, 'failure': False}
+        pending = ['']
+
+        def check(line):
+            if self.success_regex and self.success_regex.search(line):
+                matched['success'] = True
+
+            if self.failure_regex and self.failure_regex.search(line):
+                matched['failure'] = True
+
+        def handler(message):
+            # The output comes in chunks, match the patterns against the complete lines only.
+            lines = (pending[0] + message).split('\n')
+            pending[0] = lines.pop()
+
+            for line in lines:
+                check(line)
+
+            output_handler and output_handler(message)
+
+        abort_regex = self.failure_regex if self.abort_on_failure else None
+        ret_code = run_task(self.command, cwd=self.cwd, output_handler=handler, abort_regex=abort_regex, timeout=self.timeout)
+        check(pending[0])
+
+        if matched['failure']:
+            logger.warning(f'Build output matches the failure pattern {self.failure_regex.pattern}')
+            return False
+
+        if ret_code != 0:
+            return False
+
+        if self.success_regex and not matched['success']:
+            logger.warning(f'Build output does not match the success pattern {self.success_regex.pattern}')
+            return False
+
+        return True
+
+class CompilationDatabase:
+    '''
+    The compile_commands.json entries indexed by the absolute source file path.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'r') as f:
+            entries = json.load(f)
+
+        self.commands = {}
+
+        for entry in entries:
+            directory = entry.get('directory', os.path.dirname(os.path.abspath(path)))
+            filepath = os.path.normpath(os.path.join(directory, entry['file']))
+            arguments = entry.get('arguments') or shlex.split(entry['command'])
+            self.commands[filepath] = (directory, arguments)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def get_syntax_check_command(self, filepath, compiler=None):
+        'Return the working directory and the arguments checking the syntax of the file only.'
+        directory, arguments = self.commands[filepath]
+        result = [compiler or arguments[0]]
+        skip = False
+
+        for argument in arguments[1:]:
+            if skip:
+                skip = False
+            elif argument == '-o':
+                # Drop the output file, nothing will be generated.
+                skip = True
+            elif argument not in ('-c', '-fsyntax-only'):
+                result.append(argument)
+
+        return directory, result + ['-fsyntax-only']
+
+class SyntaxCheckBackend(BuildBackend):
+    '''
+    Check the syntax of the translation units affected by the changed files only, via the
+    compilation database and the header import graph, and delegate the full build to fallback.
+    '''
+    partial = True
+
+    def __init__(self, database_path, project_path, fallback=None, compiler=None, jobs=1, cache=None):
+        self.database = CompilationDatabase(database_path)
+        self.fallback = fallback
+        self.compiler = compiler
+        self.jobs = jobs
+        self.graph = HeaderGraph(cache=cache)
+        self.graph.add_project_headers(os.path.abspath(project_path))
+
+        for filepath in self.database.commands:
+            self.graph.add_file(filepath)
+
+        # Index the imports before any candidate line is removed, the removals only drop edges.
+        self.graph.get_importers()
+
+    def __repr__(self):
+        return f'<SyntaxCheckBackend: {self.database.path} ({len(self.database)} units)>'
+
+    def get_affected_units(self, changed_files):
+        'Return the translation units which compile any of the changed files.'
+        dependents = self.graph.get_dependents(os.path.abspath(path) for path in changed_files)
+        return sorted(path for path in dependents if path in self.database.commands)
+
+    def check(self, filepath):
+        directory, arguments = self.database.get_syntax_check_command(filepath, compiler=self.compiler)
+        p = subprocess.run(arguments, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return p.returncode, p.stdout.decode('utf-8', 'ignore')
+
+    def build(self, output_handler=None, changed_files=None):
+        if changed_files is None:
+            if self.fallback:
+                return self.fallback.build(output_handler=output_handler)
+
+            units = sorted(self.database.commands)
+        else:
+            units = self.get_affected_units(changed_files)
+
+        logger.debug(f'Checking the syntax of {len(units)} unit(s).')
+        succeeded = True
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            for filepath, (ret_code, message) in zip(units, executor.map(self.check, units)):
+                message and output_handler and output_handler(message)
+
+                if ret_code != 0:
+                    logger.info(f'Syntax check failed in {filepath}')
+                    succeeded = False
+
+        return succeeded
@@ -0,0 +1,217 @@
+import os, os.path
+import json
+import hashlib
+import time
+import threading
+from functools import partial
+from files import map_files, open_mapped
+from instrument import increment
+from paths import LOG_DIR
+
+import logging
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(LOG_DIR, 'cache')
+CACHE_VERSION = 1
+
+# The file system timestamp granularity, a file modified within this window after
+# scanning keeps the same mtime, so the content hash must be compared as well.
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+def read_source(filepath):
+    'Return the content digest and the text (with universal newlines) of the file.'
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    increment('files.bytes_read', len(data))
+    digest = hashlib.sha1(data).hexdigest()
+    content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    return digest, content
+
+def scan_file(extractor, filepath):
+    'Return the content digest and the extraction result of the file.'
+    digest, content = read_source(filepath)
+    return digest, extractor(content)
+
+class PersistentCache:
+    '''
+    JSON file cache of the project under the cache dir, subclasses define the entries.
+    '''
+    suffix = ''
+
+    def __init__(self, project_path, cache_dir=None):
+        self.project_path = os.path.abspath(os.path.expanduser(project_path))
+        name = hashlib.sha1(self.project_path.encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir or CACHE_DIR, f'{name}{self.suffix}.json')
+        self.entries = {}
+        self.dirty = False
+        self.hits, self.misses = 0, 0
+        self.lock = threading.RLock()
+
+    def load(self):
+        'Load the cache file if exists, discard it silently if it is broken or outdated.'
+        try:
+            with open(self.path, 'r') as f:
+                payload = json.load(f)
+
+            if payload.get('version') == CACHE_VERSION and payload.get('project') == self.project_path:
+                self.entries = payload.get('entries', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignored the broken cache {self.path}: {e}')
+
+        return self
+
+    def prune(self):
+        'Drop the outdated entries before saving.'
+        pass
+
+    def save(self):
+        'Write the cache file atomically.'
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.prune()
+            payload = {'version': CACHE_VERSION, 'project': self.project_path, 'entries': self.entries}
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f, separators=(',', ':'))
+
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            logger.debug(f'Saved cache {self.path} ({self.hits} hit(s), {self.misses} miss(es))')
+
+class ScanCache(PersistentCache):
+    '''
+    Persistent per-file extraction results, keyed by path + mtime + size and
+    falling back to the content hash when those are ambiguous.
+    '''
+    # entries: filepath -> {'mtime', 'size', 'sha1', 'racy', 'data'}
+
+    def prune(self):
+        'Drop the entries of removed files.'
+        self.entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+
+    def is_fresh(self, filepath, stat):
+        'Whether the cached entry of the file could be trusted without reading it.'
+        entry = self.entries.get(filepath)
+        return entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size and not entry['racy']
+
+    def store(self, filepath, stat, digest, data):
+        'Remember the extraction result of the file with its stat taken before reading.'
+        self.entries[filepath] = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': digest,
+            'racy': stat.st_mtime_ns >= time.time_ns() - RACY_WINDOW_NS,
+            'data': data,
+        }
+        self.dirty = True
+
+    def get(self, filepath, extractor):
+        '''
+        Return the extraction result of the file, run extractor(content) and remember
+        the result only when the file changed since the last scanning.
+        '''
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        entry = self.entries.get(filepath)
+
+        if self.is_fresh(filepath, stat):
+            self.hits += 1
+            increment('cache.hits')
+            return entry['data']
+
+        digest, content = read_source(filepath)
+
+        if entry and entry['sha1'] == digest:
+            # Touched or checked out again without any real change.
+            self.hits += 1
+            increment('cache.hits')
+            data = entry['data']
+        else:
+            self.misses += 1
+            increment('cache.misses')
+            data = extractor(content)
+
+        self.store(filepath, stat, digest, data)
+        return data
+
+    def prefetch(self, filepaths, extractor, jobs=1):
+        'Re-scan all the stale files at once, in a process pool if jobs > 1.'
+        stale = []
+
+        for filepath in map(os.path.abspath, filepaths):
+            stat = os.stat(filepath)
+
+            if not self.is_fresh(filepath, stat):
+                stale.append((filepath, stat))
+
+        if not stale:
+            return
+
+        results = map_files(partial(scan_file, extractor), [filepath for filepath, _ in stale], jobs=jobs)
+
+        for (filepath, stat), (digest, data) in zip(stale, results):
+            self.misses += 1
+            increment('cache.misses')
+            self.store(filepath, stat, digest, data)
+
+class ValidationCache(PersistentCache):
+    '''
+    Persistent validation outcomes of the candidate removals, keyed by the candidate plus the
+    content hash of its file and all the headers it imports transitively.
+    '''
+    suffix = '-validation'
+    # entries: key -> whether the removal was accepted.
+
+    def __init__(self, project_path, cache_dir=None):
+        super().__init__(project_path, cache_dir=cache_dir)
+        self.digests = {}   # filepath -> (mtime, size, sha1) of this run.
+
+    def get_digest(self, filepath):
+        stat = os.stat(filepath)
+        digest = self.digests.get(filepath)
+
+        if digest is None or digest[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open_mapped(filepath) as buffer:
+                digest = self.digests[filepath] = (stat.st_mtime_ns, stat.st_size, hashlib.sha1(buffer).hexdigest())
+
+        return digest[2]
+
+    def get_key(self, root, filepath, lineno, line, dependencies):
+        'Return the key of removing the line at the line number from the file, the paths are taken relative to root.'
+        h = hashlib.sha1()
+
+        for part in (os.path.relpath(filepath, root), str(lineno), line, self.get_digest(filepath)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+
+        for path in sorted(os.path.relpath(path, root) for path in dependencies):
+            h.update(path.encode('utf-8'))
+            h.update(self.get_digest(os.path.join(root, path)).encode('ascii'))
+
+        return h.hexdigest()
+
+    def get(self, key):
+        'Return whether the removal was accepted, or None if it was never validated.'
+        result = self.entries.get(key)
+
+        if result is None:
+            self.misses += 1
+            increment('validation_cache.misses')
+        else:
+            self.hits += 1
+            increment('validation_cache.hits')
+
+        return result
+
+    def put(self, key, accepted):
+        with self.lock:
+            self.entries[key] = accepted
+            self.dirty = True
@@ -0,0 +1,309 @@
+import os, os.path
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from functools import partial
+from files import find_source_files, map_files
+from cache import CACHE_DIR, scan_file
+from symbols import scan_source
+
+import logging
+logger = logging.getLogger(__name__)
+
+COMPACT_MAGIC = b'CAIX'
+COMPACT_VERSION = 2
+# Magic, version, byte order (0 little, 1 big), section count.
+HEADER_FORMAT = '<4sIII'
+# Section name, typecode, offset, items count.
+SECTION_FORMAT = '<32s4sQQ'
+# The sections are aligned to 8 bytes, so the arrays could be cast in place.
+ALIGNMENT = 8
+# The CSR tables of rows -> ids, stored as the '<name>.offsets' and '<name>.values' sections.
+TABLES = ('classes', 'view_controllers', 'imports', 'references', 'referrers')
+SECTIONS = ('strings.offsets', 'strings.data', 'files', 'files.mtimes', 'files.sizes', *(f'{name}.{part}' for name in TABLES for part in ('offsets', 'values')))
+
+def get_compact_index_path(project_path, cache_dir=None):
+    'Return the default index path of the project, next to its scan cache.'
+    project_path = os.path.abspath(os.path.expanduser(project_path))
+    name = hashlib.sha1(project_path.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, f'{name}-index.bin')
+
+def build_csr(rows):
+    'Return the offsets and values arrays of the rows of ids, row i spans values[offsets[i]:offsets[i + 1]].'
+    offsets, values = array('I', [0]), array('I')
+
+    for row in rows:
+        values.extend(row)
+        offsets.append(len(values))
+
+    return offsets, values
+
+def write_compact_index(project_path, path=None, cache=None, jobs=1):
+    '''
+    Scan the project and write its compact index atomically, return the index path. The strings are
+    interned and sorted, so their ids follow their order, and every table refers to them by id.
+    '''
+    project_path = os.path.abspath(os.path.expanduser(project_path))
+    path = path or get_compact_index_path(project_path)
+    filepaths = sorted(os.path.join(dirpath, filename) for dirpath, filename in find_source_files(project_path))
+    stats = [os.stat(filepath) for filepath in filepaths]
+
+    if cache is not None:
+        cache.prefetch(filepaths, scan_source, jobs=jobs)
+        records = [cache.get(filepath, scan_source) for filepath in filepaths]
+    else:
+        records = [record for _, record in map_files(partial(scan_file, scan_source), filepaths, jobs=jobs)]
+
+    relpaths = [os.path.relpath(filepath, project_path) for filepath in filepaths]
+    strings = set(relpaths)
+
+    for record in records:
+        strings.update(record['classes'], record['view_controllers'], record['imports'], record['identifiers'])
+
+    strings = sorted(strings)
+    ids = {string: i for i, string in enumerate(strings)}
+    tables = {}
+    rows = {
+        'classes': [sorted(ids[name] for name in set(record['classes'])) for record in records],
+        'view_controllers': [sorted(ids[name] for name in set(record['view_controllers'])) for record in records],
+        'imports': [[ids[name] for name in record['imports']] for record in records],
+        'references': [sorted(ids[name] for name in record['identifiers']) for record in records],
+    }
+    referrers = [[] for _ in strings]
+
+    for file_id, row in enumerate(rows['references']):
+        for symbol_id in row:
+            referrers[symbol_id].append(file_id)
+
+    rows['referrers'] = referrers
+
+    for name, table_rows in rows.items():
+        tables[f'{name}.offsets'], tables[f'{name}.values'] = build_csr(table_rows)
+
+    data = [string.encode('utf-8', 'surrogateescape') for string in strings]
+    string_offsets = array('Q', [0])
+
+    for item in data:
+        string_offsets.append(string_offsets[-1] + len(item))
+
+    sections = {
+        'strings.offsets': string_offsets,
+        'strings.data': b''.join(data),
+        'files': array('I', (ids[relpath] for relpath in relpaths)),
+        'files.mtimes': array('q', (stat.st_mtime_ns for stat in stats)),
+        'files.sizes': array('q', (stat.st_size for stat in stats)),
+        **tables,
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, COMPACT_MAGIC, COMPACT_VERSION, sys.byteorder == 'big', len(sections)))
+        offset = align(struct.calcsize(HEADER_FORMAT) + struct.calcsize(SECTION_FORMAT) * len(sections) + len(project_path.encode('utf-8')) + 4)
+        layout = []
+
+        for name, section in sections.items():
+            typecode = section.typecode if isinstance(section, array) else 'B'
+            size = len(section) * (section.itemsize if isinstance(section, array) else 1)
+            f.write(struct.pack(SECTION_FORMAT, name.encode('ascii'), typecode.encode('ascii'), offset, len(section)))
+            layout.append((offset, section))
+            offset = align(offset + size)
+
+        root = project_path.encode('utf-8')
+        f.write(struct.pack('<I', len(root)) + root)
+
+        for offset, section in layout:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section.tobytes() if isinstance(section, array) else section)
+
+    os.replace(tmp_path, path)
+    logger.debug(f'Wrote the compact index of {len(filepaths)} file(s) and {len(strings)} string(s) to {path}')
+    return path
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class CompactIndex:
+    '''
+    Read-only view of the compact index file, the sections are memory mapped and cast to typed
+    memoryviews in place, so opening it parses nothing but the section table, and all the processes
+    opening the same file share its pages. The strings are decoded on access only.
+    '''
+    __slots__ = ('path', 'project_path', 'buffer', 'sections', 'string_offsets', 'string_data', 'files')
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.load()
+        except (ValueError, TypeError, struct.error):
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, project_path, path=None):
+        'Return the index of the project, or None if it does not exist or is unreadable.'
+        path = path or get_compact_index_path(project_path)
+
+        try:
+            index = cls(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, struct.error) as e:
+            logger.warning(f'Ignored the broken compact index {path}: {e}')
+            return None
+
+        if index.project_path != os.path.abspath(os.path.expanduser(project_path)):
+            index.close()
+            return None
+
+        return index
+
+    def load(self):
+        magic, version, big_endian, count = struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+
+        if magic != COMPACT_MAGIC or version != COMPACT_VERSION or big_endian != (sys.byteorder == 'big'):
+            raise ValueError('unsupported format')
+
+        # The sections are sliced from the view, release it at once so close() has only them to release.
+        view = memoryview(self.buffer)
+        position = struct.calcsize(HEADER_FORMAT)
+        self.sections = {}
+
+        try:
+            for _ in range(count):
+                name, typecode, offset, length = struct.unpack_from(SECTION_FORMAT, self.buffer, position)
+                position += struct.calcsize(SECTION_FORMAT)
+                typecode = typecode.rstrip(b'\0').decode('ascii')
+                size = length * array(typecode).itemsize
+
+                # A truncated file would give shorter slices silently, and fail on access much later.
+                if offset + size > len(self.buffer):
+                    raise ValueError('truncated section')
+
+                self.sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + size].cast(typecode)
+        finally:
+            view.release()
+
+        missing = [name for name in SECTIONS if name not in self.sections]
+
+        if missing:
+            raise ValueError(f'missing section {missing[0]}')
+
+        root_size, = struct.unpack_from('<I', self.buffer, position)
+
+        if position + 4 + root_size > len(self.buffer):
+            raise ValueError('truncated project path')
+
+        self.project_path = bytes(self.buffer[position + 4:position + 4 + root_size]).decode('utf-8')
+        self.string_offsets = self.sections['strings.offsets']
+        self.string_data = self.sections['strings.data']
+        self.files = self.sections['files']
+
+    def close(self):
+        'Release the views before closing the mapping, the exported buffers would keep it open otherwise.'
+        for section in getattr(self, 'sections', {}).values():
+            section.release()
+
+        self.sections = {}
+        self.string_offsets = self.string_data = self.files = None
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.files)
+
+    def get_string(self, string_id):
+        return self.get_bytes(string_id).decode('utf-8', 'surrogateescape')
+
+    def get_bytes(self, string_id):
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]])
+
+    def find_string(self, string):
+        'Return the id of the string via binary search over the sorted table, or None if absent.'
+        key = string.encode('utf-8', 'surrogateescape')
+        low, high = 0, len(self.string_offsets) - 1
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.get_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low if low < len(self.string_offsets) - 1 and self.get_bytes(low) == key else None
+
+    def get_row(self, table, row):
+        'Return the ids of the row in the CSR table as a memoryview.'
+        offsets = self.sections[f'{table}.offsets']
+        return self.sections[f'{table}.values'][offsets[row]:offsets[row + 1]]
+
+    def get_filepath(self, file_id):
+        return os.path.join(self.project_path, self.get_string(self.files[file_id]))
+
+    def find_file(self, filepath):
+        'Return the file id of the path, or None if it is not indexed. The file ids follow the path order.'
+        string_id = self.find_string(os.path.relpath(os.path.abspath(filepath), self.project_path))
+
+        if string_id is None:
+            return None
+
+        file_id = bisect_left(self.files, string_id)
+        return file_id if file_id < len(self.files) and self.files[file_id] == string_id else None
+
+    def get_names(self, table):
+        'Return the unique names of all the rows in the file table, sorted since the string ids are.'
+        values = self.sections[f'{table}.values']
+        return [self.get_string(string_id) for string_id in sorted(set(values))]
+
+    def get_all_view_controllers(self):
+        return self.get_names('view_controllers')
+
+    def get_all_classes(self):
+        return self.get_names('classes')
+
+    def get_imports(self, filepath):
+        'Return the imported header names of the file, or None if it is not indexed.'
+        file_id = self.find_file(filepath)
+        return None if file_id is None else [self.get_string(string_id) for string_id in self.get_row('imports', file_id)]
+
+    def get_referrers(self, symbol_name):
+        'Return the paths of the files referencing the identifier.'
+        symbol_id = self.find_string(symbol_name)
+        return [] if symbol_id is None else [self.get_filepath(file_id) for file_id in self.get_row('referrers', symbol_id)]
+
+    def is_fresh(self, filepaths=None):
+        'Whether the project source files are the same ones indexed, with the same mtimes and sizes.'
+        if filepaths is None:
+            filepaths = [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(self.project_path)]
+
+        filepaths = sorted(filepaths)
+
+        if len(filepaths) != len(self.files):
+            return False
+
+        mtimes, sizes = self.sections['files.mtimes'], self.sections['files.sizes']
+
+        for file_id, filepath in enumerate(filepaths):
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                return False
+
+            if filepath != self.get_filepath(file_id) or stat.st_mtime_ns != mtimes[file_id] or stat.st_size != sizes[file_id]:
+                return False
+
+        return True
@@ -0,0 +1,113 @@
+import os, os.path
+import shutil
+import tempfile
+
+import logging
+logger = logging.getLogger(__name__)
+
+def write_atomically(filepath, data):
+    'Replace the file content via renaming a temporary file in the same directory, keeping the file mode.'
+    dirpath, filename = os.path.split(filepath)
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix=f'.{filename}.', suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.path.exists(filepath) and shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.path.exists(tmp_path) and os.unlink(tmp_path)
+        raise
+
+def find_line(lines, lineno, line, claimed):
+    '''
+    Return the index of the unclaimed line with the content, at the line number or the nearest one
+    if the earlier removals shifted it, or None if the content is gone.
+    '''
+    content = line.rstrip('\n').encode('utf-8')
+
+    def matches(index):
+        return index not in claimed and lines[index].rstrip(b'\r\n') == content
+
+    if 0 <= lineno < len(lines) and matches(lineno):
+        return lineno
+
+    indexes = [index for index in range(len(lines)) if matches(index)]
+    return min(indexes, key=lambda index: abs(index - lineno)) if indexes else None
+
+class EditTransaction:
+    '''
+    Line removals across the files, keyed by the line number (0-based) and the line content. Each file is
+    rewritten once and replaced atomically, its original bytes are kept in memory for rolling back.
+    '''
+
+    def __init__(self):
+        self.removals = {}      # filepath -> [(line number, line)], in the adding order.
+        self.originals = {}     # filepath -> original bytes of the touched files.
+
+    def remove_line(self, filepath, lineno, line):
+        self.removals.setdefault(filepath, []).append((lineno, line))
+
+    def capture(self, filepath):
+        'Keep the original bytes of the file for rolling back, return them.'
+        if filepath not in self.originals:
+            with open(filepath, 'rb') as f:
+                self.originals[filepath] = f.read()
+
+        return self.originals[filepath]
+
+    def apply(self):
+        'Apply all the removals, return the applied (filepath, line number, line), the ones whose line is gone are skipped.'
+        applied = []
+
+        for filepath, removals in self.removals.items():
+            lines = self.capture(filepath).splitlines(keepends=True)
+            claimed = set()
+
+            for lineno, line in removals:
+                index = find_line(lines, lineno, line, claimed)
+
+                if index is None:
+                    logger.debug(f'Line {lineno + 1} "{line}" is gone from {filepath}')
+                    continue
+
+                claimed.add(index)
+                applied.append((filepath, lineno, line))
+
+            if claimed:
+                write_atomically(filepath, b''.join(line for index, line in enumerate(lines) if index not in claimed))
+
+        self.removals = {}
+        return applied
+
+    def rollback(self):
+        '''
+        Restore the original content of the changed files only, the unchanged ones keep their mtimes,
+        so the incremental build and the scan cache do not take them as modified.
+        '''
+        for filepath, data in self.originals.items():
+            try:
+                with open(filepath, 'rb') as f:
+                    changed = f.read() != data
+            except FileNotFoundError:
+                changed = True
+
+            changed and write_atomically(filepath, data)
+
+        self.originals = {}
+
+    def commit(self):
+        'Keep the applied removals and release the original content.'
+        self.originals = {}
+
+def remove_lines(candidates):
+    'Remove the (filepath, line number, line) candidates in one transaction, return the applied ones.'
+    transaction = EditTransaction()
+
+    for filepath, lineno, line in candidates:
+        transaction.remove_line(filepath, lineno, line)
+
+    applied = transaction.apply()
+    transaction.commit()
+    return applied
@@ -0,0 +1,99 @@
+import os.path
+import json
+from abc import ABC, abstractmethod
+
+class GraphWriter(ABC):
+    '''
+    Stream the graph edges to the file as they come, subclasses define the format.
+    The nodes are written on their first edge, so only their names stay in memory.
+    '''
+
+    def __init__(self, f):
+        self.f = f
+        self.nodes = {}     # node name -> id, in the discovering order.
+        self.edges = 0
+
+    def write(self, edges):
+        'Write the whole graph of the (source name, target name) edges, return the edges count.'
+        self.begin()
+
+        for source, target in edges:
+            for name in (source, target):
+                if name not in self.nodes:
+                    self.nodes[name] = len(self.nodes)
+                    self.write_node(name)
+
+            self.write_edge(source, target)
+            self.edges += 1
+
+        self.end()
+        return self.edges
+
+    def begin(self):
+        pass
+
+    def write_node(self, name):
+        pass
+
+    @abstractmethod
+    def write_edge(self, source, target):
+        pass
+
+    def end(self):
+        pass
+
+class DotWriter(GraphWriter):
+    def quote(self, name):
+        return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def begin(self):
+        self.f.write('digraph {\n    rankdir=LR;\n')
+
+    def write_edge(self, source, target):
+        self.f.write(f'    {self.quote(source)} -> {self.quote(target)};\n')
+
+    def end(self):
+        self.f.write('}\n')
+
+class JsonWriter(GraphWriter):
+    'Write {"edges": [[source, target]], "nodes": [name]}, the nodes follow the edges to stream them.'
+
+    def begin(self):
+        self.f.write('{"edges": [')
+
+    def write_edge(self, source, target):
+        self.f.write((',\n' if self.edges else '\n') + json.dumps([source, target]))
+
+    def end(self):
+        self.f.write('\n], "nodes": ' + json.dumps(list(self.nodes)) + '}\n')
+
+class GraphMLWriter(GraphWriter):
+    def escape(self, name):
+        return name.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    def begin(self):
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                     '  <key id="name" for="node" attr.name="name" attr.type="string"/>\n'
+                     '  <graph edgedefault="directed">\n')
+
+    def write_node(self, name):
+        self.f.write(f'    <node id="n{self.nodes[name]}"><data key="name">{self.escape(name)}</data></node>\n')
+
+    def write_edge(self, source, target):
+        self.f.write(f'    <edge source="n{self.nodes[source]}" target="n{self.nodes[target]}"/>\n')
+
+    def end(self):
+        self.f.write('  </graph>\n</graphml>\n')
+
+GRAPH_WRITERS = {'dot': DotWriter, 'json': JsonWriter, 'graphml': GraphMLWriter}
+
+def get_graph_format(filepath):
+    'Guess the graph format by the file extension, DOT by default.'
+    _, ext = os.path.splitext(filepath)
+    return {'.json': 'json', '.graphml': 'graphml'}.get(ext.lower(), 'dot')
+
+def write_graph(filepath, edges, format=None):
+    'Stream the (source name, target name) edges to the graph file, return the edges count.'
+    with open(filepath, 'w') as f:
+        return GRAPH_WRITERS[format or get_graph_format(filepath)](f).write(edges)
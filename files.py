@@ -1,18 +1,239 @@
 import os, os.path
+import re
+import mmap
+import subprocess
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from instrument import span, increment, is_enabled, call_recorded, merge_recorded
 
-def find_files(dirpath, dir_filter=None, file_filter=None):
-    'Filter all the files with directory and file filters.'
-    for root, dirs, files in os.walk(dirpath):
-        for name in dirs:
-            if dir_filter and not dir_filter(name, root):
-                dirs.remove(name)
+import logging
+logger = logging.getLogger(__name__)
+
+# The directories never worth scanning, like the dependencies and the build products.
+DEFAULT_IGNORE_PATTERNS = ['.git/', 'Pods/', 'lib/', 'grpc/', 'DerivedData/', 'build/', '*.xcassets/', '*.xcodeproj/', '*.xcworkspace/']
+# The project config with the extra .gitignore syntax patterns.
+CONFIG_IGNORE_FILENAME = '.analyzerignore'
+GIT_IGNORE_FILENAME = '.gitignore'
+
+def translate_ignore_pattern(pattern):
+    'Return the regex, negated and directory only flags of the .gitignore pattern, or None for the blank lines and comments.'
+    pattern = pattern.rstrip('\n')
+
+    if not pattern.endswith('\\ '):
+        pattern = pattern.rstrip(' ')
+
+    if not pattern or pattern.startswith('#'):
+        return None
+
+    negated = pattern.startswith('!')
+    pattern = pattern[1:] if negated else pattern
+    pattern = pattern[1:] if pattern.startswith('\\') and pattern[1:2] in ('#', '!') else pattern
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+
+    if not pattern:
+        return None
+
+    # The pattern without any inner slash matches the name at any depth.
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = '' if anchored else '(?:.*/)?'
+    i = 0
+
+    while i < len(pattern):
+        c = pattern[i]
+
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        elif pattern.startswith('**', i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == '/'):
+            regex += '.*'
+            i += 2
+            continue
+        elif c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[' and ']' in pattern[i + 2:]:
+            j = pattern.index(']', i + 2)
+            group = pattern[i + 1:j].replace('\\', '\\\\')
+            regex += '[' + ('^' + group[1:] if group[0] in '!^' else group) + ']'
+            i = j
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+
+        i += 1
+
+    return regex, negated, dir_only
+
+class IgnoreMatcher:
+    '''
+    Compiled .gitignore syntax patterns relative to the base directory, the later patterns and the
+    nested matchers win. All the patterns of one matcher are combined into one regex.
+    '''
+
+    def __init__(self, patterns=(), base='', parent=None):
+        self.base = base            # the relative path of the patterns' directory, '' for the root.
+        self.parent = parent
+        self.negations = []         # group index - 1 -> whether the pattern is negated.
+        self.regexes = {}           # is dir -> combined regex, the last pattern as the first alternative.
+        rules = [rule for rule in map(translate_ignore_pattern, patterns) if rule]
+
+        for is_dir in (False, True):
+            alternatives = [(regex, negated) for regex, negated, dir_only in reversed(rules) if is_dir or not dir_only]
+            self.negations.append([negated for _, negated in alternatives])
+            # Anchor the whole alternation, every alternative must match the whole path and not a prefix only.
+            self.regexes[is_dir] = re.compile('(?:' + '|'.join(f'({regex})' for regex, _ in alternatives) + r')\Z') if alternatives else None
 
-        for name in files:
-            if file_filter and not file_filter(name, root):
+    @classmethod
+    def from_file(cls, filepath, base='', parent=None):
+        'Return the matcher of the ignore file, or the parent if the file does not exist.'
+        try:
+            with open(filepath, 'r', errors='ignore') as f:
+                return cls(f.readlines(), base=base, parent=parent)
+        except OSError:
+            return parent
+
+    @classmethod
+    def for_project(cls, project_path):
+        'Return the matcher of the default patterns and the project config.'
+        root = cls(DEFAULT_IGNORE_PATTERNS)
+        return cls.from_file(os.path.join(project_path, CONFIG_IGNORE_FILENAME), parent=root)
+
+    def is_ignored(self, relpath, is_dir=False):
+        'Whether the path relative to the root directory is ignored.'
+        matcher = self
+
+        while matcher:
+            regex = matcher.regexes[is_dir]
+            path = relpath[len(matcher.base) + 1:] if matcher.base else relpath
+            match = regex and (regex.match(path) if not matcher.base or relpath.startswith(matcher.base + '/') else None)
+
+            if match:
+                return not matcher.negations[is_dir][match.lastindex - 1]
+
+            matcher = matcher.parent
+
+        return False
+
+def walk_files(dirpath, dir_filter=None, file_filter=None, ignore=None):
+    '''
+    Yield (root, name) of all the files under the directory via os.scandir, the filtered and ignored
+    directories are pruned. The .gitignore files are honoured if the ignore matcher is given.
+    '''
+    stack = [(dirpath, '', ignore)]
+
+    while stack:
+        root, relroot, matcher = stack.pop()
+
+        try:
+            with span('files.scandir'), os.scandir(root) as iterator:
+                entries = list(iterator)
+        except OSError:
+            continue
+
+        increment('files.visited', len(entries))
+
+        if matcher is not None and any(entry.name == GIT_IGNORE_FILENAME for entry in entries):
+            matcher = IgnoreMatcher.from_file(os.path.join(root, GIT_IGNORE_FILENAME), base=relroot, parent=matcher)
+
+        subdirs = []
+
+        for entry in entries:
+            relpath = f'{relroot}/{entry.name}' if relroot else entry.name
+
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
                 continue
 
+            if is_dir:
+                # Like os.walk, the symbolic links to directories are not followed.
+                if entry.is_symlink() or dir_filter and not dir_filter(entry.name, root) or matcher and matcher.is_ignored(relpath, True):
+                    continue
+
+                subdirs.append((entry.path, relpath, matcher))
+            elif (file_filter is None or file_filter(entry.name, root)) and not (matcher and matcher.is_ignored(relpath)):
+                yield root, entry.name
+
+        stack.extend(reversed(subdirs))
+
+def list_git_files(dirpath):
+    '''
+    Return the relative paths of the files under the directory tracked by git or untracked but not
+    ignored, or None if the directory is not in a git work tree.
+    '''
+    increment('git.calls', 2)
+
+    try:
+        # The deleted files check stats the whole work tree, run it along with the listing.
+        listing, deleted = [subprocess.Popen(['git', 'ls-files', '-z', *options], cwd=dirpath, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                            for options in (['--cached', '--others', '--exclude-standard'], ['--deleted'])]
+    except OSError:
+        return None
+
+    with span('git.ls-files'):
+        results = [(p.communicate()[0], p.returncode) for p in (listing, deleted)]
+
+    if any(ret_code != 0 for _, ret_code in results):
+        return None
+
+    paths, deleted = [output.decode('utf-8', 'surrogateescape').split('\0')[:-1] for output, _ in results]
+
+    if deleted:
+        deleted = set(deleted)
+        paths = [path for path in paths if path not in deleted]
+
+    increment('files.visited', len(paths))
+    return paths
+
+def git_files(dirpath, dir_filter=None, file_filter=None, ignore=None, paths=None):
+    'Yield (root, name) of the files listed by git like walk_files, which git has applied the .gitignore files to.'
+    roots = {'': dirpath}     # relative directory -> full path, or None if it is filtered or ignored.
+
+    def get_root(relroot):
+        if relroot not in roots:
+            parent, _, name = relroot.rpartition('/')
+            parent_root = get_root(parent)
+            accepted = parent_root is not None and (dir_filter is None or dir_filter(name, parent_root)) and not (ignore and ignore.is_ignored(relroot, True))
+            roots[relroot] = os.path.join(parent_root, name) if accepted else None
+
+        return roots[relroot]
+
+    for path in paths if paths is not None else list_git_files(dirpath):
+        relroot, _, name = path.rpartition('/')
+        root = get_root(relroot)
+
+        if root is not None and (file_filter is None or file_filter(name, root)) and not (ignore and ignore.is_ignored(path)):
             yield root, name
 
+def find_project_files(dirpath, dir_filter=None, file_filter=None, lister=None):
+    '''
+    Filter all the project files with directory and file filters, skipping the ignored ones.
+    The lister is 'git' (git ls-files), 'scandir' or 'auto' (git if the directory is in a git
+    work tree), defaults to the FILE_LISTER environment variable or 'auto'.
+    '''
+    lister = lister or os.environ.get('FILE_LISTER') or 'auto'
+    ignore = IgnoreMatcher.for_project(dirpath)
+    paths = list_git_files(dirpath) if lister in ('auto', 'git') else None
+
+    if paths is not None:
+        return git_files(dirpath, dir_filter=dir_filter, file_filter=file_filter, ignore=ignore, paths=paths)
+
+    if lister == 'git':
+        logger.warning(f'Failed to list the files of {dirpath} via git, fall back to scanning the directory.')
+
+    return walk_files(dirpath, dir_filter=dir_filter, file_filter=file_filter, ignore=ignore)
+
+def find_files(dirpath, dir_filter=None, file_filter=None):
+    'Filter all the files with directory and file filters.'
+    return walk_files(dirpath, dir_filter=dir_filter, file_filter=file_filter)
+
 def find_directories(dirpath, dir_filter=None):
     'Filter all the files with directory and file filters.'
     for root, dirs, _ in os.walk(dirpath):
@@ -26,19 +247,91 @@ def find_directories(dirpath, dir_filter=None):
 
 def find_source_files(dir, include_headers=True, extensions=None, dir_filter=None):
     'Return all the source files under the specified directory.'
-    expected_exts = extensions if extensions is not None else ['.m', '.mm']
+    expected_exts = list(extensions) if extensions is not None else ['.m', '.mm']
 
     if include_headers:
         expected_exts.append('.h')
 
-    def directory_filter(dirname, dirpath):
-        return dirname not in ['.git', 'Pods', 'lib', 'grpc'] and (dir_filter is None or dir_filter(dirname, dirpath))
-
     def file_filter(filename, dirpath):
         _, ext = os.path.splitext(filename)
         return ext in expected_exts
 
-    return find_files(dir, dir_filter=directory_filter, file_filter=file_filter)
+    return find_project_files(dir, dir_filter=dir_filter, file_filter=file_filter)
+
+def map_files(func, filepaths, jobs=1):
+    'Apply func to all the files, fan out to a process pool if jobs > 1, the results keep the files\' order.'
+    if jobs is None or jobs <= 1:
+        yield from map(func, filepaths)
+        return
+
+    filepaths = list(filepaths)
+    # Feed each worker a few batches, small enough to balance the uneven file sizes.
+    chunksize = max(1, min(256, len(filepaths) // (jobs * 4)))
+    executor = ProcessPoolExecutor(max_workers=jobs)
+
+    try:
+        if not is_enabled():
+            yield from executor.map(func, filepaths, chunksize=chunksize)
+            return
+
+        # Collect the spans and counters recorded in the worker processes.
+        for result, data in executor.map(partial(call_recorded, func), filepaths, chunksize=chunksize):
+            merge_recorded(data)
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+@contextmanager
+def open_mapped(filepath):
+    '''
+    Map the file into memory read only, the pages are loaded on demand and could be dropped
+    under memory pressure, so scanning a huge file never holds its whole content.
+    '''
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        increment('files.bytes_read', size)
+
+        if size == 0:
+            # Empty files could not be mapped.
+            yield b''
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            hasattr(mmap, 'MADV_SEQUENTIAL') and buffer.madvise(mmap.MADV_SEQUENTIAL)
+            yield buffer
+
+def iter_file_matches(regex, filepath, with_lines=False):
+    '''
+    Yield the decoded whole matches of the bytes regex in the memory mapped file lazily. Yield (line number, line, match)
+    instead if with_lines, the line number is 0-based and the line is the one the match starts in.
+    '''
+    lineno, line_start = 0, 0
+
+    with open_mapped(filepath) as buffer:
+        for match in regex.finditer(buffer):
+            text = match.group().decode('utf-8', 'replace')
+            start = match.start()
+            # Release the buffer exported by the match before the mapping is closed.
+            del match
+
+            if not with_lines:
+                yield text
+                continue
+
+            # Count the newlines since the previous match only, mmap has no count(), so the slice is copied.
+            lineno += buffer[line_start:start].count(b'\n')
+            line_start = buffer.rfind(b'\n', 0, start) + 1
+            line_end = buffer.find(b'\n', start)
+            line = buffer[line_start:line_end if line_end >= 0 else len(buffer)].decode('utf-8', 'replace').rstrip('\r')
+            yield lineno, line, text
+
+def get_file_size(filepath):
+    'Return the bytes and lines count of the file.'
+    with open(filepath, 'rb') as f:
+        data = f.read()
+
+    increment('files.bytes_read', len(data))
+    return len(data), data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
 
 def find_xcode_workspace(dir):
     'Find the first matched xcode workspace file\' fullpath.'
@@ -57,25 +350,3 @@ def find_xcode_workspace(dir):
         pass
 
     return None
-
-def remove_line_from_file(filepath, content):
-    'Remove specified line content from the file.'
-
-    result = False
-
-    if not content.endswith('\n'):
-        content += '\n'
-
-    with open(filepath, "r+") as f:
-        lines = f.readlines()
-        f.seek(0)
-
-        for line in lines:
-            if line != content:
-                f.write(line)
-            else:
-                result = True
-
-        f.truncate()
-
-    return result
@@ -0,0 +1,446 @@
+from symbols import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+def iter_bits(bits):
+    'Yield the indexes of the set bits in ascending order.'
+    digits = bin(bits)[:1:-1]
+    index = digits.find('1')
+
+    while index >= 0:
+        yield index
+        index = digits.find('1', index + 1)
+
+def get_strongly_connected_components(nodes, get_successors):
+    '''
+    Return the strongly connected components ([node]) of the graph reachable from the nodes, via the
+    iterative Tarjan algorithm. Each component comes after all the components it reaches.
+    '''
+    indexes, lowlinks = {}, {}
+    stack, on_stack = [], set()
+    components = []
+
+    def visit(node):
+        indexes[node] = lowlinks[node] = len(indexes)
+        stack.append(node)
+        on_stack.add(node)
+        return node, iter(get_successors(node))
+
+    for start in nodes:
+        if start in indexes:
+            continue
+
+        work = [visit(start)]
+
+        while work:
+            node, successors = work[-1]
+
+            for sub_node in successors:
+                if sub_node not in indexes:
+                    work.append(visit(sub_node))
+                    break
+                elif sub_node in on_stack:
+                    lowlinks[node] = min(lowlinks[node], indexes[sub_node])
+            else:
+                work.pop()
+
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+                if lowlinks[node] == indexes[node]:
+                    component = []
+
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member is node:
+                            break
+
+                    components.append(component)
+
+    return components
+
+def get_adjacency(edges):
+    'Return node -> [sub node] of the edges, every node has an entry.'
+    adjacency = {}
+
+    for node, sub_node in edges:
+        adjacency.setdefault(node, []).append(sub_node)
+        adjacency.setdefault(sub_node, [])
+
+    return adjacency
+
+def find_cycles(edges):
+    'Return the strongly connected components forming the import cycles, the largest first.'
+    adjacency = get_adjacency(edges)
+    components = get_strongly_connected_components(list(adjacency), adjacency.__getitem__)
+    cycles = [component for component in components if len(component) > 1 or component[0] in adjacency[component[0]]]
+    return sorted(cycles, key=len, reverse=True)
+
+def reduce_transitive_edges(edges):
+    '''
+    Return the edges without the ones implied by the other paths, in the original order. The edges
+    inside the import cycles are kept, their reduction is not unique.
+    '''
+    edges = list(edges)
+    adjacency = get_adjacency(edges)
+    components = get_strongly_connected_components(list(adjacency), adjacency.__getitem__)
+    component_of = {node: index for index, component in enumerate(components) for node in component}
+    reachable = []  # component index -> bitset of the components reachable from it, including itself.
+
+    for index, component in enumerate(components):
+        bits = 1 << index
+
+        for node in component:
+            for sub_node in adjacency[node]:
+                bits |= reachable[component_of[sub_node]] if component_of[sub_node] != index else 0
+
+        reachable.append(bits)
+
+    def is_redundant(node, sub_node):
+        source, target = component_of[node], component_of[sub_node]
+
+        if source == target:
+            return False
+
+        # Any other path to the target must leave the source component by another edge.
+        return any(reachable[component_of[other]] >> target & 1 for other in adjacency[node] if component_of[other] not in (source, target))
+
+    return [(node, sub_node) for node, sub_node in edges if not is_redundant(node, sub_node)]
+
+class HeaderNode:
+    __slots__ = ('name', 'dir', 'imports')
+
+    def __init__(self, name, dir=None):
+        self.name = name        # header filename.
+        self.dir = dir          # header file's parent path, None for the external headers.
+        self.imports = None     # imported header names, loaded lazily.
+
+    def __repr__(self):
+        return f'<Node: {self.name} {self.dir or ""}>'
+
+    @property
+    def key(self):
+        return (self.name, self.dir)
+
+    @property
+    def fullpath(self):
+        return os.path.join(self.dir, self.name) if self.dir else None
+
+class HeaderGraph:
+    '''
+    Header import graph with the nodes indexed by (name, dir) and set-based edges.
+    '''
+
+    def __init__(self, cache=None, compact=None):
+        self.cache = cache
+        self.compact = compact  # the fresh compact index of the project, the imports of its files are looked up in it.
+        self.nodes = {}     # (name, dir) -> node.
+        self.names = {}     # name -> [node], in the adding order.
+        self.edges = set()  # (importer key, imported key).
+        self.children = {} # importer key -> [imported node], in the discovering order.
+        self.importers = None   # imported header name -> [importer node], built lazily.
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def find(self, name, dir=None):
+        'Return the node with the name and dir, or the first added one with the name if dir is None.'
+        if dir is not None:
+            return self.nodes.get((name, dir))
+
+        nodes = self.names.get(name)
+        return nodes[0] if nodes else None
+
+    def get_or_create(self, name, dir=None):
+        'Return whether the node is created and the node itself.'
+        node = self.find(name, dir)
+
+        if node:
+            return False, node
+
+        node = HeaderNode(name, dir=dir)
+        self.nodes[node.key] = node
+        self.names.setdefault(name, []).append(node)
+        self.importers = None
+        return True, node
+
+    def add_file(self, filepath):
+        'Add the source or header file as a node.'
+        return self.get_or_create(os.path.basename(filepath), dir=os.path.dirname(filepath))
+
+    def add_project_headers(self, project_path, dir_filter=None):
+        'Add all the header files under the project as nodes.'
+        for root, name in find_source_files(project_path, extensions=[], dir_filter=dir_filter):
+            created, _ = self.get_or_create(name, dir=root)
+
+            if not created:
+                logger.warning(f'Found duplicated header file {name}')
+
+        return self
+
+    def get_imports(self, node):
+        'Return the imported header names of the node, each header file is read only once.'
+        if node.imports is None and node.fullpath and self.compact is not None:
+            node.imports = self.compact.get_imports(node.fullpath)
+
+        if node.imports is None:
+            node.imports = get_all_header_imports(node.fullpath, cache=self.cache) if node.fullpath else []
+
+        return node.imports
+
+    def invalidate(self, filepath):
+        'Forget the imports of the file, call it after the file content changed.'
+        node = self.find(os.path.basename(filepath), dir=os.path.dirname(filepath))
+
+        if node is not None:
+            node.imports = None
+            self.importers = None
+
+    def get_dependencies(self, filepath):
+        '''
+        Return the full paths of the project headers imported by the file directly or transitively.
+        The imports are matched by header name, so the result errs on the side of including more files.
+        '''
+        _, root = self.add_file(filepath)
+        visited, stack = {root.key}, [root]
+        dependencies = set()
+
+        while stack:
+            node = stack.pop()
+
+            for header in self.get_imports(node):
+                for sub_node in self.names.get(header, []):
+                    if sub_node.key in visited or sub_node.fullpath is None:
+                        continue
+
+                    visited.add(sub_node.key)
+                    dependencies.add(sub_node.fullpath)
+                    stack.append(sub_node)
+
+        return dependencies
+
+    def get_importers(self):
+        'Return the reverse import index: imported header name -> [importer node].'
+        if self.importers is None:
+            self.importers = {}
+
+            for node in list(self.nodes.values()):
+                for header in self.get_imports(node):
+                    self.importers.setdefault(header, []).append(node)
+
+        return self.importers
+
+    def get_dependents(self, filepaths):
+        '''
+        Return the full paths of the files and all the files importing them directly or transitively.
+        The imports are matched by header name, so the result errs on the side of including more files.
+        '''
+        importers = self.get_importers()
+        dependents = set()
+        stack = list(filepaths)
+
+        while stack:
+            path = stack.pop()
+
+            if path in dependents:
+                continue
+
+            dependents.add(path)
+            stack.extend(node.fullpath for node in importers.get(os.path.basename(path), []))
+
+        return dependents
+
+    def get_successors(self, node):
+        'Return the project header nodes imported by the node, the imports are matched by header name.'
+        return [sub_node for header in self.get_imports(node) for sub_node in self.names.get(header, []) if sub_node.fullpath and sub_node is not node]
+
+    def get_strongly_connected_components(self, nodes):
+        'Return the strongly connected components of the header graph reachable from the nodes.'
+        return get_strongly_connected_components(nodes, self.get_successors)
+
+    def get_closures(self, nodes):
+        '''
+        Return the nodes reachable from the given ones and node key -> bitset of the nodes it imports
+        directly or transitively (including itself), the bits index the returned nodes. The closures are
+        unioned once per strongly connected component, so the cycles cost nothing extra.
+        '''
+        components = self.get_strongly_connected_components(nodes)
+        ordered = [node for component in components for node in component]
+        bits = {node.key: index for index, node in enumerate(ordered)}
+        closures = {}
+
+        for component in components:
+            closure = 0
+
+            for node in component:
+                closure |= 1 << bits[node.key]
+
+                for sub_node in self.get_successors(node):
+                    # The members of the same component are not closed yet, their bits are set above.
+                    closure |= closures.get(sub_node.key, 0)
+
+            for node in component:
+                closures[node.key] = closure
+
+        return ordered, closures
+
+    def add_edge(self, node, sub_node):
+        'Return False if the edge exists already.'
+        edge = (node.key, sub_node.key)
+
+        if edge in self.edges:
+            return False
+
+        self.edges.add(edge)
+        self.children.setdefault(node.key, []).append(sub_node)
+        return True
+
+    def walk(self, root):
+        '''
+        Discover the graph from the root node in depth-first order, yield (depth, importer, node)
+        for the root and every newly discovered edge. Each edge is followed only once, so the
+        header imported by different headers is expanded under each of them.
+        '''
+        yield 0, None, root
+        stack = [(root, iter(self.get_imports(root)))]
+
+        while stack:
+            node, imports = stack[-1]
+            header = next(imports, None)
+
+            if header is None:
+                stack.pop()
+                continue
+
+            created, sub_node = self.get_or_create(header)
+
+            if created or sub_node.fullpath is None:
+                # Skip the external header files.
+                continue
+
+            if not self.add_edge(node, sub_node):
+                continue
+
+            yield len(stack), node, sub_node
+            stack.append((sub_node, iter(self.get_imports(sub_node))))
+
+CLASS_BLOCK_REGEX = re.compile(r'@(?:interface|implementation)\s+(\w+).*?(?:@end\b|\Z)', flags=re.S|re.U)
+FORWARD_DECLARATION_REGEX = re.compile(r'^[ \t]*@class\b[^;]*;', flags=re.M)
+INTERFACE_BUILDER_CLASS_REGEX = r'customClass="(\w+)"'
+
+def scan_class_references(filepath):
+    '''
+    Return the classes declared in the source file and the identifiers referenced in its code and
+    strings, grouped by the @interface / @implementation block enclosing them ('' for none).
+    '''
+    with open(filepath, 'r') as f:
+        content = f.read()
+
+    declared = []
+
+    for definition in re.findall(CLASS_REGEX, content, flags=re.M|re.U):
+        name = re.match(r'\w*', get_interface_name(definition)).group()
+        name and declared.append(name)
+
+    # The line ranges of the class blocks, which never nest.
+    blocks = [(content.count('\n', 0, m.start()), content.count('\n', 0, m.end()), m.group(1)) for m in CLASS_BLOCK_REGEX.finditer(content)]
+    # The @class forward declarations are not references.
+    forwards = set(content.count('\n', 0, m.start()) for m in FORWARD_DECLARATION_REGEX.finditer(content))
+    references = {}
+    index = 0
+
+    for identifier, lineno, kind in tokenize(content):
+        if kind not in (CODE, STRING) or lineno in forwards:
+            continue
+
+        while index < len(blocks) and blocks[index][1] < lineno:
+            index += 1
+
+        owner = blocks[index][2] if index < len(blocks) and blocks[index][0] <= lineno else ''
+        references.setdefault(owner, set()).add(identifier)
+
+    return declared, {owner: sorted(identifiers) for owner, identifiers in references.items()}
+
+class ClassGraph:
+    '''
+    Class-level reference graph, a class references the classes named in the code or string
+    literals of its @interface and @implementation blocks, including the categories. The classes
+    referenced outside of the project class blocks are treated as roots, like in main.m.
+    '''
+
+    def __init__(self):
+        self.files = {}         # class name -> [declaring file].
+        self.references = {}    # class name -> referenced class names.
+        self.roots = {}         # root class name -> reason.
+
+    def build(self, project_path, jobs=1):
+        'Scan all the source files under the project in one pass.'
+        filepaths = [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(project_path)]
+        unowned = set()
+        owned = {}
+
+        for filepath, (declared, references) in zip(filepaths, map_files(scan_class_references, filepaths, jobs=jobs)):
+            for name in declared:
+                self.files.setdefault(name, []).append(filepath)
+
+            for owner, identifiers in references.items():
+                owned.setdefault(owner, set()).update(identifiers)
+
+        for owner, identifiers in owned.items():
+            if owner in self.files:
+                self.references[owner] = identifiers
+            else:
+                # Outside of any class, or in the categories of the external classes.
+                unowned.update(identifiers)
+
+        for name in self.files:
+            self.references.setdefault(name, set())
+
+        for name, references in self.references.items():
+            references.intersection_update(self.files)
+            references.discard(name)
+
+        for name in unowned.intersection(self.files):
+            self.roots.setdefault(name, 'referenced outside of the classes')
+
+        return self
+
+    def add_roots(self, names, reason):
+        'Mark the existing classes as roots.'
+        for name in names:
+            name in self.files and self.roots.setdefault(name, reason)
+
+    def add_app_delegate_roots(self):
+        self.add_roots([name for name in self.files if name.endswith('AppDelegate')], 'app delegate')
+
+    def add_interface_builder_roots(self, project_path):
+        'Mark the classes referenced by the storyboards and xibs as roots.'
+        def file_filter(filename, dirpath):
+            return os.path.splitext(filename)[1] in ('.storyboard', '.xib')
+
+        for dirpath, filename in find_project_files(project_path, file_filter=file_filter):
+            with open(os.path.join(dirpath, filename), 'r') as f:
+                self.add_roots(re.findall(INTERFACE_BUILDER_CLASS_REGEX, f.read()), f'referenced by {filename}')
+
+    def get_reachable_classes(self):
+        'Return all the classes reachable from the roots, in linear time of the graph size.'
+        reachable = set(self.roots)
+        stack = list(reachable)
+
+        while stack:
+            for name in self.references[stack.pop()]:
+                if name not in reachable:
+                    reachable.add(name)
+                    stack.append(name)
+
+        return reachable
+
+    def get_dead_classes(self):
+        'Return the sorted (class name, files) of all the classes unreachable from the roots.'
+        reachable = self.get_reachable_classes()
+        return [(name, self.files[name]) for name in sorted(self.files) if name not in reachable]
@@ -0,0 +1,117 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Shared no-op span, so the disabled instrumentation costs one global lookup per call.
+NULL_SPAN = nullcontext()
+
+class Recorder:
+    '''
+    Named spans (calls, seconds) and counters of a run, the spans of the same name are summed up.
+    The nested spans are counted in both, so their seconds do not add up to the wall time.
+    '''
+
+    def __init__(self):
+        self.spans = {}         # name -> [calls, seconds]
+        self.counters = {}      # name -> value
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_span(self, name, seconds, calls=1):
+        with self.lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def get_data(self):
+        'Return the picklable spans and counters, to be merged into the recorder of the parent process.'
+        with self.lock:
+            return {name: tuple(entry) for name, entry in self.spans.items()}, dict(self.counters)
+
+    def merge(self, data):
+        spans, counters = data
+
+        for name, (calls, seconds) in spans.items():
+            self.add_span(name, seconds, calls=calls)
+
+        for name, value in counters.items():
+            self.increment(name, value)
+
+    def get_report(self):
+        'Return the JSON serializable report, the spans are ordered by their seconds.'
+        spans, counters = self.get_data()
+
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'spans': {name: {'calls': calls, 'seconds': round(seconds, 6)} for name, (calls, seconds) in sorted(spans.items(), key=lambda item: -item[1][1])},
+            'counters': dict(sorted(counters.items())),
+        }
+
+# The recorder of the current process, the instrumentation is disabled while it is None.
+recorder = None
+
+def enable():
+    'Start recording the spans and counters from now on, return the recorder.'
+    global recorder
+    recorder = Recorder()
+    return recorder
+
+def disable():
+    global recorder
+    recorder = None
+
+def is_enabled():
+    return recorder is not None
+
+def span(name):
+    'Return the context manager timing its block as the named span, a shared no-op one if disabled.'
+    return recorder.span(name) if recorder is not None else NULL_SPAN
+
+def increment(name, value=1):
+    'Add the value to the named counter if enabled.'
+    recorder is not None and recorder.increment(name, value)
+
+def traced(name):
+    'Decorate the function to time its calls as the named span, not for the generator functions.'
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return func(*args, **kwargs)
+
+            with recorder.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def call_recorded(func, *args):
+    '''
+    Run func in a worker process with a fresh recorder (the forked one holds the parent's data),
+    return its result and the recorded data for the parent to merge.
+    '''
+    global recorder
+    recorder = Recorder()
+    return func(*args), recorder.get_data()
+
+def merge_recorded(data):
+    'Merge the data returned by call_recorded if enabled.'
+    recorder is not None and recorder.merge(data)
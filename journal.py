@@ -0,0 +1,101 @@
+import os, os.path
+import json
+import hashlib
+import threading
+from datetime import datetime
+from paths import LOG_DIR
+
+import logging
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.path.join(LOG_DIR, 'journals')
+
+class Journal:
+    '''
+    Append-only JSON lines journal of a cleanup run, each record is fsynced before returning.
+    It lives outside of the project, so neither the git commits nor the discards touch it.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.file = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_project(cls, project_path, journal_dir=None):
+        project_path = os.path.abspath(os.path.expanduser(project_path))
+        name = hashlib.sha1(project_path.encode('utf-8')).hexdigest()
+        return cls(os.path.join(journal_dir or JOURNAL_DIR, f'{name}.jsonl'))
+
+    def open(self, resume=False):
+        'Open the journal for appending, load the existing records to resume or start a new one.'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.records, size = self.load() if resume else ([], 0)
+        self.file = open(self.path, 'a' if resume else 'w')
+
+        if resume:
+            # Cut the torn tail, the following records must start from a new line.
+            self.file.truncate(size)
+        else:
+            # Persist the new directory entry as well.
+            fd = os.open(os.path.dirname(self.path), os.O_RDONLY)
+
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        return self
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def load(self):
+        'Return all the complete records and their size, the torn tail written by a crash is ignored.'
+        records, size = [], 0
+
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('incomplete line')
+
+                        records.append(json.loads(line))
+                        size += len(line)
+                    except ValueError:
+                        logger.warning(f'Ignored the broken journal record: {line!r}')
+                        break
+        except FileNotFoundError:
+            pass
+
+        return records, size
+
+    def record(self, event, **fields):
+        'Append the record and flush it to the disk.'
+        record = dict(event=event, time=str(datetime.now()), **fields)
+
+        with self.lock:
+            self.records.append(record)
+
+            if self.file:
+                self.file.write(json.dumps(record) + '\n')
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def get_completed_symbols(self):
+        'Return the symbols whose candidates were all validated and committed.'
+        return set(record['symbol'] for record in self.records if record['event'] == 'done')
+
+    def get_interrupted_symbols(self):
+        'Return the symbols started but not completed.'
+        completed = self.get_completed_symbols()
+        return [record['symbol'] for record in self.records if record['event'] == 'symbol' and record['symbol'] not in completed]
+
+    def get_counts(self):
+        'Return the accepted and rejected candidate counts recorded.'
+        outcomes = [record['accepted'] for record in self.records if record['event'] == 'candidate']
+        return outcomes.count(True), outcomes.count(False)
@@ -0,0 +1,47 @@
+import re
+
+# Token classes of the identifier occurrences.
+CODE = 'code'
+IMPORT = 'import'
+LINE_COMMENT = 'line_comment'
+BLOCK_COMMENT = 'block_comment'
+STRING = 'string'
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<import>^[ \t]*\#[ \t]*(?:import|include)[ \t]*(?:"[^"\n]*"|<[^>\n]*>))
+    | (?P<block_comment>/\*.*?(?:\*/|\Z))
+    | (?P<line_comment>//[^\n]*)
+    | (?P<string>@?"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)
+    | (?P<code>[^\W\d]\w*)
+    | (?P<newline>\n)
+''', flags=re.M|re.S|re.U|re.X)
+
+WORD_REGEX = re.compile(r'[^\W\d]\w*|\n', flags=re.U)
+
+def tokenize(content):
+    'Yield (identifier, line number, token class) of all the identifiers in the Objective-C source.'
+    lineno = 0
+
+    for match in TOKEN_REGEX.finditer(content):
+        kind = match.lastgroup
+
+        if kind == 'newline':
+            lineno += 1
+        elif kind == CODE:
+            yield match.group(), lineno, CODE
+        else:
+            # Take the identifiers inside the import, comment or string literal, which may span lines.
+            for word in WORD_REGEX.findall(match.group()):
+                if word == '\n':
+                    lineno += 1
+                else:
+                    yield word, lineno, kind
+
+def get_occurrences(content):
+    'Return identifier -> [(line number, token class)] of the source.'
+    occurrences = {}
+
+    for identifier, lineno, kind in tokenize(content):
+        occurrences.setdefault(identifier, []).append((lineno, kind))
+
+    return occurrences
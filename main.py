@@ -1,11 +1,26 @@
 #!/usr/bin/env python
 
-import logging, logging.config, coloredlogs
-import os.path
+import logging
+import os, os.path
 import click
-from dotenv import load_dotenv
-from symbols import *
-from analyze import *
+from export import GRAPH_WRITERS
+from report import DEDUP_SIZE
+
+def create_file_handler(filename, **kwargs):
+    '''
+    Return the rotating file handler which creates the log directory and the file on the first record only.
+    The log directory is imported here, after the .env file which could move it is loaded.
+    '''
+    from logging.handlers import TimedRotatingFileHandler
+    from paths import LOG_DIR
+    filename = os.path.join(LOG_DIR, filename)
+
+    class LazyFileHandler(TimedRotatingFileHandler):
+        def _open(self):
+            os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+            return super()._open()
+
+    return LazyFileHandler(filename, delay=True, **kwargs)
 
 # Refer to
 #   1. https://stackoverflow.com/a/7507842/1677041
@@ -39,9 +54,9 @@ LOGGING_CONFIG = {
         },
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            '()': create_file_handler,
             'formatter': 'standard',
-            'filename': 'logs/main.log',
+            'filename': 'main.log',
             'backupCount': 10,
             'when': 'midnight',
             'interval': 1,
@@ -61,16 +76,137 @@ LOGGING_CONFIG = {
     }
 }
 
-logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
+def configure_logging(level):
+    'Set up the logging of the command being run, importing the handlers and formatters here keeps --help fast.'
+    import logging.config
+
+    logging.config.dictConfig(LOGGING_CONFIG)
+    logging.getLogger().setLevel(level)
+    logger.setLevel(level)
+
+def start_profiling(ctx, report_path=None, stats_path=None):
+    'Record the spans and counters (and the cProfile stats if stats_path) of the command, dump them once it finishes.'
+    import instrument
+    recorder = instrument.enable()
+    profiler = None
+
+    if stats_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(stats_path)
+
+        if report_path:
+            import json
+            report = json.dumps(recorder.get_report(), indent=2)
+
+            if report_path == '-':
+                click.echo(report, err=True)
+            else:
+                with open(report_path, 'w') as f:
+                    f.write(report + '\n')
+
+        instrument.disable()
+
+    ctx.call_on_close(finish)
+
 
 @click.group()
 @click.option('--debug/--no-debug', default=False, help='Enable logger level to DEBUG')
+@click.option('--cache/--no-cache', default=True, help='Reuse the persistent scan results of the unchanged files.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True, help='Number of processes to scan the source files with.')
+@click.option('--daemon/--no-daemon', default=True, help='Ask the running serve daemon of the project first.')
+@click.option('--profile', 'profile_path', type=click.Path(dir_okay=False, allow_dash=True), default=None, help='Write the JSON report of the timing spans and counters to the file, - for stderr.')
+@click.option('--profile-stats', 'stats_path', type=click.Path(dir_okay=False), default=None, help='Dump the cProfile stats to the file for pstats or snakeviz.')
+@click.option('--output-format', 'output_format', type=click.Choice(['text', 'ndjson']), default='text', show_default=True, help='Print the findings as text, or stream them as JSON lines one by one.')
+@click.option('--sort/--no-sort', default=False, help='Sort the JSON lines findings, which holds all of them until the end.')
+@click.option('--dedup-size', type=click.IntRange(min=1), default=DEDUP_SIZE, show_default=True, help='Number of the recent keys remembered to drop the duplicate JSON lines findings.')
 @click.pass_context
-def cli(ctx, debug):
-    logger.setLevel(logging.DEBUG if debug else logging.WARNING)
+def cli(ctx, debug, cache, jobs, daemon, profile_path, stats_path, output_format, sort, dedup_size):
+    configure_logging(logging.DEBUG if debug else logging.WARNING)
+    (profile_path or stats_path) and start_profiling(ctx, report_path=profile_path, stats_path=stats_path)
     debug and click.echo('Debug mode is on')
+    ctx.ensure_object(dict)
+    ctx.obj['cache'] = cache
+    ctx.obj['jobs'] = jobs
+    ctx.obj['daemon'] = daemon
+    ctx.obj['format'] = output_format
+    ctx.obj['sort'] = sort
+    ctx.obj['dedup_size'] = dedup_size
+
+def open_scan_cache(ctx, project):
+    'Load the scan cache of the project if enabled, it will be saved once the command finishes.'
+    if not ctx.obj.get('cache'):
+        return None
+
+    from cache import ScanCache
+    cache = ScanCache(project).load()
+    ctx.call_on_close(cache.save)
+    return cache
+
+def open_compact_index(ctx, project):
+    'Return the compact index of the project built before if still fresh and the cache is enabled, or None.'
+    if not ctx.obj.get('cache'):
+        return None
+
+    from compact import CompactIndex
+    index = CompactIndex.open(project)
+
+    if index is not None and not index.is_fresh():
+        index.close()
+        return None
+
+    index is not None and ctx.call_on_close(index.close)
+    return index
+
+def open_symbol_index(ctx, project):
+    'Return the symbol index of the project, backed by its fresh compact index if any instead of scanning the files.'
+    from symbols import SymbolIndex
+    compact = open_compact_index(ctx, project)
+    cache = open_scan_cache(ctx, project) if compact is None else None
+    return SymbolIndex(project, cache=cache, jobs=ctx.obj['jobs'], compact=compact).build()
+
+def open_import_sources(ctx, project):
+    'Return the scan cache and the compact index to read the imports from, the fresh compact index spares loading the cache.'
+    compact = open_compact_index(ctx, project)
+    return (open_scan_cache(ctx, project) if compact is None else None), compact
+
+def is_streaming(ctx):
+    return ctx.obj.get('format') == 'ndjson'
+
+def stream_records(ctx, records, dedup_key=None):
+    'Write the finding records as JSON lines to stdout, sorted only if --sort.'
+    from report import write_records, get_record_key
+    return write_records(records, sort_key=get_record_key if ctx.obj.get('sort') else None, dedup_key=dedup_key, dedup_size=ctx.obj['dedup_size'])
+
+def iter_unused_import_records(ctx, project):
+    from symbols import iter_unused_code_import_usages
+
+    for symbol, filepath, lineno, line, classification in iter_unused_code_import_usages(project, index=open_symbol_index(ctx, project)):
+        yield {'kind': 'unused_import', 'symbol': symbol, 'file': filepath, 'line': lineno + 1, 'text': line, 'classification': classification}
+
+def check_streaming_options(ctx, *names):
+    'Reject the text only options given explicitly with --output-format ndjson, rather than ignoring them.'
+    from click.core import ParameterSource
+
+    for name in names:
+        if is_streaming(ctx) and ctx.get_parameter_source(name) == ParameterSource.COMMANDLINE:
+            option = next('/'.join(param.opts + param.secondary_opts) for param in ctx.command.params if param.name == name)
+            raise click.UsageError(f'{option} works with --output-format text only.', ctx=ctx)
+
+def query_daemon(ctx, project, command, **args):
+    'Return the result answered by the serve daemon of the project, or None if disabled or not running.'
+    if not ctx.obj.get('daemon'):
+        return None
+
+    from server import query_server
+    return query_server(project, command, **args)
 
 
 @cli.command()
@@ -81,13 +217,62 @@ def get_all_vcs(ctx, project, show_count):
     '''
     Output all the view controllers from the project.
     '''
-    all_vcs = get_all_view_controllers(project)
+    check_streaming_options(ctx, 'show_count')
+
+    if is_streaming(ctx):
+        from symbols import iter_view_controllers
+        records = ({'kind': 'view_controller', 'symbol': name, 'file': filepath, 'line': lineno + 1, 'text': line}
+                   for name, filepath, lineno, line in iter_view_controllers(project, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs']))
+        stream_records(ctx, records, dedup_key=lambda record: record['symbol'])
+        return
+
+    all_vcs = query_daemon(ctx, project, 'get-all-vcs')
+
+    if all_vcs is None:
+        index = open_compact_index(ctx, project)
+        all_vcs = index.get_all_view_controllers() if index is not None else None
+
+    if all_vcs is None:
+        from symbols import get_all_view_controllers
+        all_vcs = get_all_view_controllers(project, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs'])
 
     for result in all_vcs:
         print(f'@"{result}", ')
 
     show_count and print(len(all_vcs))
 
+@cli.command()
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--show-count/--hide-count', default=True, help='Show total count or not.')
+@click.pass_context
+def get_all_classes(ctx, project, show_count):
+    '''
+    Output all the classes from the project.
+    '''
+    check_streaming_options(ctx, 'show_count')
+
+    if is_streaming(ctx):
+        from symbols import iter_classes
+        records = ({'kind': 'class', 'symbol': name, 'file': filepath, 'line': lineno + 1, 'text': line}
+                   for name, filepath, lineno, line in iter_classes(project, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs']))
+        stream_records(ctx, records, dedup_key=lambda record: record['symbol'])
+        return
+
+    all_classes = query_daemon(ctx, project, 'get-all-classes')
+
+    if all_classes is None:
+        index = open_compact_index(ctx, project)
+        all_classes = index.get_all_classes() if index is not None else None
+
+    if all_classes is None:
+        from symbols import get_all_classes as get_project_classes
+        all_classes = get_project_classes(project, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs'])
+
+    for result in all_classes:
+        print(result)
+
+    show_count and print(len(all_classes))
+
 @cli.command()
 @click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
 @click.option('--show-count/--hide-count', default=True, help='Show total count or not.')
@@ -96,8 +281,20 @@ def analyze_unused_symbols(ctx, project, show_count):
     '''
     Analyze all the unused symbols from the project. FYI.
     '''
+    if is_streaming(ctx):
+        stream_records(ctx, iter_unused_import_records(ctx, project))
+        return
+
+    unused = query_daemon(ctx, project, 'unused-imports')
+
+    if unused is not None:
+        # The daemon answers the paths relative to the project, print them like a local run does.
+        unused = [(symbol, os.path.join(project, filepath), results) for symbol, filepath, results in unused]
+    else:
+        from symbols import get_all_unused_code_import
+        unused = get_all_unused_code_import(project, index=open_symbol_index(ctx, project))
 
-    for symbol, filepath, results in get_all_unused_code_import(project):
+    for symbol, filepath, results in unused:
         logger.info(f'Found unused symbol {symbol} in \n{filepath} with {len(results)} result(s):\n{".".join(results)}\n')
 
 @cli.command()
@@ -108,29 +305,219 @@ def analyze_unused_vc_imports(ctx, project, show_count):
     '''
     Analyze all the unused view controller's imports from the project. FYI.
     '''
+    if is_streaming(ctx):
+        stream_records(ctx, iter_unused_import_records(ctx, project))
+        return
 
-    all_vcs = get_all_view_controllers(project)
+    from symbols import get_unused_symbol_code_import
 
-    for vc in all_vcs:
+    index = open_symbol_index(ctx, project)
+
+    for vc in index.get_all_view_controllers():
         print(f'Analyzing {vc}')
-        get_unused_symbol_code_import(vc, project)
+        get_unused_symbol_code_import(vc, project, index=index)
+
+@cli.command('include-cost')
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--top', type=click.IntRange(min=0), default=50, show_default=True, help='Number of the most expensive headers to output, 0 for all.')
+@click.option('--show-units/--hide-units', default=False, help='Output the translation units ranked by the transitive lines or not.')
+@click.pass_context
+def include_cost(ctx, project, top, show_units):
+    '''
+    Output the headers ranked by the preprocessing work they cost in all the translation units.
+    '''
+    from analyze import get_include_costs
+
+    cache, compact = open_import_sources(ctx, project)
+    header_costs, unit_costs = get_include_costs(project, cache=cache, jobs=ctx.obj['jobs'], compact=compact)
+
+    if is_streaming(ctx):
+        fields = ['lines', 'headers', 'transitive_lines', 'transitive_bytes']
+        records = [{'kind': 'header_cost', 'file': cost.path, 'cost': cost.cost, 'fan_in': cost.fan_in, **{name: getattr(cost, name) for name in fields}} for cost in header_costs[:top or None]]
+        records += [{'kind': 'unit_cost', 'file': cost.path, **{name: getattr(cost, name) for name in fields}} for cost in unit_costs] if show_units else []
+        stream_records(ctx, records)
+        return
+
+    print('cost\tfan-in\tlines\theaders\ttransitive lines\ttransitive bytes\theader')
+
+    for cost in header_costs[:top or None]:
+        print(f'{cost.cost}\t{cost.fan_in}\t{cost.lines}\t{cost.headers}\t{cost.transitive_lines}\t{cost.transitive_bytes}\t{cost.path}')
+
+    if show_units:
+        print('\nlines\theaders\ttransitive lines\ttransitive bytes\tunit')
+
+        for cost in unit_costs:
+            print(f'{cost.lines}\t{cost.headers}\t{cost.transitive_lines}\t{cost.transitive_bytes}\t{cost.path}')
+
+@cli.command('find-dead-classes')
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--root', 'roots', multiple=True, help='Class name always alive, could be specified multiple times.')
+@click.option('--roots-file', type=click.File('r'), default=None, help='File with one alive class name per line.')
+@click.option('--show-count/--hide-count', default=True, help='Show total count or not.')
+@click.pass_context
+def find_dead_classes(ctx, project, roots, roots_file, show_count):
+    '''
+    Output all the classes unreachable from the app delegates, storyboards, xibs and the roots.
+    '''
+    from analyze import find_dead_classes as search_dead_classes
+
+    check_streaming_options(ctx, 'show_count')
+    roots = list(roots) + ([line.strip() for line in roots_file if line.strip()] if roots_file else [])
+    dead_classes = search_dead_classes(project, roots=roots, jobs=ctx.obj['jobs'])
+
+    if is_streaming(ctx):
+        stream_records(ctx, ({'kind': 'dead_class', 'symbol': name, 'files': filepaths} for name, filepaths in dead_classes))
+        return
+
+    for name, filepaths in dead_classes:
+        print(f'{name}\t{", ".join(filepaths)}')
+
+    show_count and print(len(dead_classes))
+
+@cli.command()
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--batch-size', type=click.IntRange(min=1), default=32, show_default=True, help='Number of candidate lines validated by one build.')
+@click.option('--build-command', default=None, help='Validate with the shell command instead of xcodebuild, e.g. "make".')
+@click.option('--success-regex', default=None, help='Output pattern required for a successful build command.')
+@click.option('--failure-regex', default=None, help='Output pattern marking a failed build command.')
+@click.option('--early-abort/--no-early-abort', default=True, help='Kill the build on the first compile error (or --failure-regex match).')
+@click.option('--build-timeout', type=click.FloatRange(min=0, min_open=True), default=None, help='Seconds before killing a build as failed.')
+@click.option('--incremental/--clean', default=True, help='Keep the xcodebuild products between validations or not.')
+@click.option('--compile-db', type=click.Path(exists=True, dir_okay=False), default=None, help='Syntax-check the affected units in the compile_commands.json, build fully at the batch boundaries only.')
+@click.option('--compiler', default=None, help='Compiler for the syntax checks, e.g. clang, defaults to the one in the compilation database.')
+@click.option('--cooldown', type=click.IntRange(min=0), default=10, show_default=True, help='Seconds to sleep after each full build.')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Number of git worktrees validating the symbols concurrently.')
+@click.option('--reuse-results/--no-reuse-results', default=True, help='Skip the removals validated before with the same file and header contents.')
+@click.option('--resume', is_flag=True, default=False, help='Continue the interrupted run from its journal.')
+@click.pass_context
+def check_unused_imports(ctx, project, batch_size, build_command, success_regex, failure_regex, early_abort, build_timeout, incremental, compile_db, compiler, cooldown, workers, reuse_results, resume):
+    '''
+    Remove all the unused imports from the project, commit them after validating with builds.
+    '''
+    from analyze import check_unused_import, check_unused_import_parallel
+    from build import XcodeBuildBackend, CommandBuildBackend, SyntaxCheckBackend, XCODE_ERROR_REGEX
+    from cache import ValidationCache
+    from journal import Journal
+
+    def backend_factory(path):
+        if build_command:
+            return CommandBuildBackend(build_command, cwd=path, success_regex=success_regex, failure_regex=failure_regex, abort_on_failure=early_abort, timeout=build_timeout)
+        else:
+            return XcodeBuildBackend.from_project(path, incremental=incremental, abort_regex=XCODE_ERROR_REGEX if early_abort else None, timeout=build_timeout)
+
+    cache = open_scan_cache(ctx, project)
+    results_cache = None
+
+    if reuse_results:
+        results_cache = ValidationCache(project).load()
+        ctx.call_on_close(results_cache.save)
+
+    journal = Journal.for_project(project).open(resume=resume)
+    ctx.call_on_close(journal.close)
+
+    if workers > 1:
+        if compile_db:
+            raise click.UsageError('--compile-db works with --workers 1 only.')
+
+        check_unused_import_parallel(project, backend_factory, workers=workers, cache=cache, jobs=ctx.obj['jobs'], batch_size=batch_size, cooldown=cooldown, results_cache=results_cache, journal=journal)
+        return
+
+    backend = backend_factory(project)
+
+    if compile_db:
+        backend = SyntaxCheckBackend(compile_db, project, fallback=backend, compiler=compiler, jobs=ctx.obj['jobs'], cache=cache)
+
+    check_unused_import(project, cache=cache, jobs=ctx.obj['jobs'], batch_size=batch_size, backend=backend, cooldown=cooldown, results_cache=results_cache, journal=journal)
 
 @cli.command()
 @click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
 @click.argument('entry', envvar='ENTRY_HEADER', type=click.Path(exists=True, dir_okay=False))
 @click.option('--raw-result/--hide-raw-result', default=True, help='Show raw graph in stdout or not.')
-@click.option('--dot-file', type=click.Path(dir_okay=False), default=None, help='Generate the graphviz result to the dot file.')
+@click.option('--output-file', '--dot-file', type=click.Path(dir_okay=False), default=None, help='Write the graph to the file.')
+@click.option('--format', 'graph_format', type=click.Choice(sorted(GRAPH_WRITERS)), default=None, help='Graph file format, guessed by the file extension by default (DOT).')
+@click.option('--reduce/--no-reduce', default=False, help='Drop the edges implied by the other import paths from the graph file or not.')
+@click.option('--cycles/--no-cycles', default=False, help='Report the import cycles or not.')
 @click.pass_context
-def generate_header_graph(ctx, project, entry, raw_result, dot_file):
+def generate_header_graph(ctx, project, entry, raw_result, output_file, graph_format, reduce, cycles):
     '''
     Generate all the headers import graph with specified project and header entry.
     '''
     project_dir = os.path.expanduser(project)
     pch_header = os.path.join(project, entry)
 
-    generate_header_tree(project_dir, pch_header, show_raw_graph=raw_result, dotfile=dot_file)
+    if is_streaming(ctx):
+        if output_file or reduce:
+            raise click.UsageError('--output-file and --reduce work with --output-format text only.')
+
+        from analyze import iter_header_import_records
+        cache, compact = open_import_sources(ctx, project)
+        stream_records(ctx, iter_header_import_records(project_dir, pch_header, show_cycles=cycles, cache=cache, compact=compact))
+        return
+    # The daemon runs in its own working directory, send it the absolute entry path.
+    tree = query_daemon(ctx, project, 'header-tree', entry=os.path.abspath(pch_header)) if not (output_file or reduce or cycles) else None
+
+    if tree is not None:
+        for depth, name in tree:
+            raw_result and print(f'{"    " * depth}{name}')
+
+        return
 
+    from analyze import generate_header_tree
+    cache, compact = open_import_sources(ctx, project)
+    generate_header_tree(project_dir, pch_header, show_raw_graph=raw_result, output_file=output_file, format=graph_format, reduce=reduce, show_cycles=cycles, cache=cache, compact=compact)
+
+@cli.command('build-index')
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--output-file', type=click.Path(dir_okay=False), default=None, help='Write the index to the file instead of the cache directory.')
+@click.pass_context
+def build_index(ctx, project, output_file):
+    '''
+    Write the compact memory-mappable index of the project, the later commands reuse it while the files are unchanged.
+    '''
+    from compact import write_compact_index
+
+    path = write_compact_index(project, path=output_file, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs'])
+    print(path)
+
+@cli.command('serve')
+@click.argument('project', envvar='PROJECT', type=click.Path(exists=True, file_okay=False))
+@click.option('--interval', type=click.FloatRange(min=0.1), default=2.0, show_default=True, help='Seconds between polling the source files\' mtimes.')
+@click.pass_context
+def serve_project(ctx, project, interval):
+    '''
+    Keep the project index in memory and answer the other commands over a unix socket.
+    '''
+    from server import serve
+
+    try:
+        serve(project, cache=open_scan_cache(ctx, project), jobs=ctx.obj['jobs'], interval=interval)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+def find_env_file():
+    'Return the nearest .env file from the script directory up like dotenv does, so dotenv is imported only if there is one.'
+    dirpath = os.path.dirname(os.path.abspath(__file__))
+
+    while True:
+        filepath = os.path.join(dirpath, '.env')
+
+        if os.path.isfile(filepath):
+            return filepath
+
+        parent = os.path.dirname(dirpath)
+
+        if parent == dirpath:
+            return None
+
+        dirpath = parent
 
 if __name__ == '__main__':
-    load_dotenv()
+    env_file = find_env_file()
+
+    if env_file:
+        from dotenv import load_dotenv
+        load_dotenv(env_file)
+
     cli()
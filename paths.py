@@ -0,0 +1,5 @@
+import os, os.path
+
+# The directory of the logs, caches, journals and worktrees, the ANALYZER_LOG_DIR environment variable moves it
+# e.g. off the checkout. It is read on import, so main.py imports this module only after loading the .env file.
+LOG_DIR = os.environ.get('ANALYZER_LOG_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
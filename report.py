@@ -0,0 +1,85 @@
+import sys
+import json
+from collections import OrderedDict
+
+# Keys remembered for the deduplication, the memory stays bounded however many findings come.
+DEDUP_SIZE = 1 << 16
+
+def get_record_key(record):
+    'Return the sorting key of the finding record, by its symbol, file and line.'
+    return (record.get('symbol') or '', record.get('file') or '', record.get('line') or 0)
+
+class BoundedSet:
+    '''
+    Set of the most recently seen maxsize keys, the least recent ones are forgotten, so
+    a duplicate far apart from its first occurrence might pass again.
+    '''
+
+    def __init__(self, maxsize=DEDUP_SIZE):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        'Remember the key, return whether it is new.'
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return False
+
+        self.keys[key] = None
+
+        if len(self.keys) > self.maxsize:
+            self.keys.popitem(last=False)
+
+        return True
+
+class RecordWriter:
+    '''
+    Write the findings as JSON lines, each one is flushed as soon as it is written, so the consumers
+    could process them incrementally. With sort_key, the records are buffered and written sorted on
+    close instead. With dedup_key, the records of the recently seen keys are dropped.
+    '''
+
+    def __init__(self, f=None, sort_key=None, dedup_key=None, dedup_size=DEDUP_SIZE):
+        self.f = f or sys.stdout
+        self.sort_key = sort_key
+        self.dedup_key = dedup_key
+        self.seen = BoundedSet(dedup_size) if dedup_key else None
+        self.pending = []
+        self.count = 0
+
+    def write(self, record):
+        if self.seen is not None and not self.seen.add(self.dedup_key(record)):
+            return
+
+        if self.sort_key:
+            self.pending.append(record)
+        else:
+            self.emit(record)
+
+    def emit(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.f.flush()
+        self.count += 1
+
+    def close(self):
+        'Write the buffered records if sorting, return the count of the written records.'
+        for record in sorted(self.pending, key=self.sort_key):
+            self.emit(record)
+
+        self.pending = []
+        return self.count
+
+def write_records(records, f=None, sort_key=None, dedup_key=None, dedup_size=DEDUP_SIZE):
+    'Write all the records as JSON lines, return the count of the written ones.'
+    writer = RecordWriter(f, sort_key=sort_key, dedup_key=dedup_key, dedup_size=dedup_size)
+
+    for record in records:
+        writer.write(record)
+
+    return writer.close()
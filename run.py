@@ -1,7 +1,15 @@
 import subprocess
 import pty
 import os, os.path
-import distutils.spawn
+import re
+import codecs
+import signal
+import asyncio
+import shlex
+import shutil
+from functools import lru_cache
+from instrument import span, increment
+from paths import LOG_DIR
 
 from datetime import datetime
 from time import time
@@ -9,125 +17,207 @@ from time import time
 import logging
 logger = logging.getLogger(__file__)
 
-OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
-os.path.exists(OUTPUT_DIR) or os.makedirs(OUTPUT_DIR, exist_ok=True)
+OUTPUT_DIR = LOG_DIR
 
-def run_xcode_build(workspace, scheme, output_dir=None, quiet_mode=False, output_handler=None):
-    '''
-    Run task in a sub-process.
+# Larger reads cut the syscalls and the callbacks of the verbose build logs.
+READ_SIZE = 64 * 1024
+# Seconds to wait for the killed process group before SIGKILL, and for the output after the process exits.
+KILL_GRACE = 5
+EOF_GRACE = 1
+# The first fatal compile error decides the build result, from xcodebuild or xcpretty.
+XCODE_ERROR_REGEX = r'\berror: |^\s*\u274c|\*\* BUILD FAILED \*\*'
 
-    References:
-    https://stackoverflow.com/a/12471855/1677041
-    https://stackoverflow.com/a/28925318/1677041
+def run_xcode_build(workspace, scheme, output_dir=None, quiet_mode=False, output_handler=None, clean=True, abort_regex=XCODE_ERROR_REGEX, timeout=None):
+    '''
+    Build the scheme of the workspace via xcodebuild, skip the clean action for an incremental build.
     '''
-
-    cur_time = datetime.fromtimestamp(time()).strftime('%Y%m%d-%H%M%S-%f')
-    fout_path = os.path.join(output_dir or OUTPUT_DIR, f'output-{cur_time}.log')
-    foutput = open(fout_path, 'wb')
 
     quiet = '-quiet' if quiet_mode else ''
+    actions = 'clean build' if clean else 'build'
     cmd = f'''
         set -euo pipefail
 
         if [ -x "$(command -v xcpretty)" ]; then
-            /usr/bin/xcodebuild -workspace "{workspace}" -scheme "{scheme}" -arch x86_64 {quiet} clean build | xcpretty
+            /usr/bin/xcodebuild -workspace "{workspace}" -scheme "{scheme}" -arch x86_64 {quiet} {actions} | xcpretty
         else
-            /usr/bin/xcodebuild -workspace "{workspace}" -scheme "{scheme}" -arch x86_64 {quiet} clean build;
+            /usr/bin/xcodebuild -workspace "{workspace}" -scheme "{scheme}" -arch x86_64 {quiet} {actions};
             echo "xcpretty is not installed, suggest to install it and try again.";
         fi
     '''
 
+    return run_task(cmd, output_dir=output_dir, output_handler=output_handler, abort_regex=abort_regex, timeout=timeout) == 0
+
+def kill_process_group(pid, sig=signal.SIGTERM):
     try:
-        master, slave = pty.openpty() # provide tty to enable line-buffering for sub-process.
-        p = subprocess.Popen(['/bin/sh', '-c', cmd], stdout=slave, stderr=slave, close_fds=True)
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
 
+async def supervise_task(cmd, cwd, foutput, output_handler=None, abort_regex=None, timeout=None):
+    '''
+    Run the command in its own process group with a pty, stream the output and kill the whole
+    group once any output line matches the abort_regex or the timeout expires. Return the exit
+    code, negative if killed by a signal, and never 0 once aborted even if the process exits cleanly.
+    '''
+    loop = asyncio.get_running_loop()
+    master, slave = pty.openpty() # provide tty to enable line-buffering for sub-process.
+
+    try:
+        p = await asyncio.create_subprocess_exec('/bin/sh', '-c', cmd, cwd=cwd, stdout=slave, stderr=slave, start_new_session=True)
+    finally:
         # Close the slave descriptor! otherwise we will hang forever waiting for input.
         os.close(slave)
 
-        def read(fd):
-            try:
-                while True:
-                    buffer = os.read(fd, 1024)
-                    if not buffer:
-                        return
+    decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+    pending = ['']
+    eof = loop.create_future()
+    abort = asyncio.Event()
+
+    def on_readable():
+        try:
+            buffer = os.read(master, READ_SIZE)
+        except OSError:
+            # Unfortunately with a pty, an OSError (EIO) will be thrown at EOF.
+            buffer = b''
 
-                    yield buffer
+        if not buffer:
+            loop.remove_reader(master)
+            eof.done() or eof.set_result(None)
+            return
 
-            # Unfortunately with a pty, an IOError will be thrown at EOF.
-            # On Python 2, OSError will be thrown instead.
-            except (IOError, OSError) as e:
-                pass
+        foutput.write(buffer)
 
-        for buffer in read(master):
-            foutput.write(buffer)
+        if not output_handler and (abort_regex is None or abort.is_set()):
+            return
 
-            if output_handler:
-                message = buffer.decode('utf-8', 'ignore')
-                output_handler(message)
+        message = decoder.decode(buffer)
+        output_handler and output_handler(message)
 
-        ret_code = p.poll()
+        if abort_regex is not None and not abort.is_set():
+            # Match the complete lines only, the output comes in chunks.
+            lines = (pending[0] + message).split('\n')
+            pending[0] = lines.pop()
 
-        if ret_code == 0:
-            logger.info('Completed!')
-        else:
-            if ret_code < 0:
-                logger.warning(f'Killed by signal {ret_code}')
+            for line in lines:
+                if abort_regex.search(line):
+                    logger.warning(f'Aborting the task on the output: {line.strip()}')
+                    abort.set()
+                    break
 
-            logger.warning(f'Completed with error! Code is {ret_code}')
+    loop.add_reader(master, on_readable)
+    waiter = asyncio.ensure_future(p.wait())
+    aborter = asyncio.ensure_future(abort.wait())
 
-        logger.info(f'Check the task result under the path {fout_path}')
+    try:
+        done, _ = await asyncio.wait([waiter, aborter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        if waiter not in done:
+            abort.is_set() or logger.warning(f'Killing the task after the timeout {timeout}s')
+            kill_process_group(p.pid)
 
-        result = ret_code == 0
-    except subprocess.CalledProcessError as e:
-        logger.exception(f'Exception:\ncode:{e.returncode}\noutput:{e.output}')
-        result = False
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), KILL_GRACE)
+            except asyncio.TimeoutError:
+                kill_process_group(p.pid, signal.SIGKILL)
+
+        # Always reap the process, the output EOF comes before it exits.
+        ret_code = await waiter
+
+        try:
+            # The orphan grandchildren may hold the pty open, drain the rest for a while only.
+            await asyncio.wait_for(eof, EOF_GRACE)
+        except asyncio.TimeoutError:
+            logger.warning('The task output is still open after it exits, stop reading it.')
     finally:
-        foutput.close()
+        aborter.cancel()
+        eof.done() or loop.remove_reader(master)
+        os.close(master)
+
+    if abort.is_set() and ret_code == 0:
+        # The process may exit with 0 after the abort, e.g. the shell trapping the signal.
+        ret_code = -signal.SIGTERM
+
+    return ret_code
+
+def run_task(cmd, cwd=None, output_dir=None, output_handler=None, abort_regex=None, timeout=None):
+    '''
+    Run task in a sub-process, return the exit code. It is killed early once any output line
+    matches the abort_regex, or the task runs longer than the timeout in seconds.
+
+    References:
+    https://stackoverflow.com/a/12471855/1677041
+    https://stackoverflow.com/a/28925318/1677041
+    '''
+
+    cur_time = datetime.fromtimestamp(time()).strftime('%Y%m%d-%H%M%S-%f')
+    output_dir = output_dir or OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    fout_path = os.path.join(output_dir, f'output-{cur_time}.log')
+    abort_regex = re.compile(abort_regex, flags=re.M) if isinstance(abort_regex, str) else abort_regex
+
+    with open(fout_path, 'wb') as foutput, span('run.task'):
+        ret_code = asyncio.run(supervise_task(cmd, cwd, foutput, output_handler=output_handler, abort_regex=abort_regex, timeout=timeout))
 
-    return result
+    if ret_code == 0:
+        logger.info('Completed!')
+    else:
+        if ret_code < 0:
+            logger.warning(f'Killed by signal {ret_code}')
+
+        logger.warning(f'Completed with error! Code is {ret_code}')
+
+    logger.info(f'Check the task result under the path {fout_path}')
+    return ret_code
 
 
-def run_git_command(git_repo, command):
-    '''Run sub-command in the specified git repsitory.'''
+@lru_cache(maxsize=None)
+def find_executable(name):
+    'Return the full path of the executable in PATH, resolved once per process.'
+    return shutil.which(name)
 
-    executable = distutils.spawn.find_executable('git')
+def run_git_command(git_repo, command, input=None):
+    '''
+    Run sub-command (an argument list or a shell-like string) in the specified git repository, return
+    the exit code, output and error. Both pipes are drained together, so a large output never blocks it.
+    '''
+
+    executable = find_executable('git')
 
     if executable is None:
         logger.error('git is missing in the envionment paths!')
         return -1, None, None
 
-    try:
-        cmd = f'{executable} -C "{git_repo}" {command}'
-        p = subprocess.Popen(['/bin/sh', '-c', cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    args = shlex.split(command) if isinstance(command, str) else list(command)
+    increment('git.calls')
 
-        ret_code = p.wait()
-        output, error = p.stdout.read().decode('utf-8'), p.stderr.read().decode('utf-8')
+    try:
+        with span('git'):
+            p = subprocess.run([executable, '-C', git_repo, *args], input=input.encode('utf-8', 'surrogateescape') if input is not None else None, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        return ret_code, output, error
-    except Exception as e:
+        return p.returncode, p.stdout.decode('utf-8', 'surrogateescape'), p.stderr.decode('utf-8', 'replace')
+    except OSError as e:
         logger.exception(e)
 
     return -1, None, None
 
 def run_git_status(git_repo):
-    ret_code, output, error = run_git_command(git_repo, 'status --porcelain=v1')
+    ret_code, output, error = run_git_command(git_repo, ['status', '--porcelain=v1', '-z'])
 
     if ret_code == 0:
         if not output:
             return None
 
-        # https://git-scm.com/docs/git-status
+        # https://git-scm.com/docs/git-status, the paths are NUL terminated and never quoted.
         file_list = []
+        entries = iter(output.split('\0')[:-1])
+
+        for entry in entries:
+            status, path = entry[:2], entry[3:]
+
+            if 'R' in status or 'C' in status:
+                # Use the new file path, the original one follows.
+                next(entries, None)
 
-        for line in output.splitlines():
-            # Get the relative file path
-            path = line[3:]
-            # Use the the new file path if rename/copy mode exists
-            idx = path.find('->')
-            if idx != -1:
-                path = path[idx + 2:]
-            # Strip the quoted string literal if whitespace or other nonprintable characters exist
-            path = path.strip(' "\'')
             # Convert to the full file path
             path = os.path.abspath(os.path.join(git_repo, path))
 
@@ -142,18 +232,73 @@ def run_git_status(git_repo):
 
     return None
 
+def get_git_paths_input(git_repo, paths):
+    'Return the NUL terminated paths relative to the repository for the --stdin -z options.'
+    return ''.join(os.path.relpath(path, git_repo) + '\0' for path in sorted(set(paths)))
+
+def run_git_stage(git_repo, paths):
+    'git: stage the changes of the specified files only, without scanning the whole tree.'
+    paths = list(paths)
+
+    if not paths:
+        return True
+
+    ret_code, _, error = run_git_command(git_repo, ['update-index', '--add', '--remove', '-z', '--stdin'], input=get_git_paths_input(git_repo, paths))
+    ret_code == 0 or logger.error(f'Error: {error}')
+    return ret_code == 0
+
 def run_git_add_all(git_repo):
     'git: add all the unstaged files to staged.'
-    ret_code, _, _ = run_git_command(git_repo, 'add -A .')
+    ret_code, _, _ = run_git_command(git_repo, ['add', '-A', '.'])
     return ret_code == 0
 
 def run_git_discard(git_repo):
     'git: discard all the unstaged file\'s changes.'
-    ret_code, _, _ = run_git_command(git_repo, f'checkout -- .')
+    ret_code, _, _ = run_git_command(git_repo, ['checkout', '--', '.'])
     return ret_code == 0
 
 def run_git_commit(git_repo, message=None):
-    'git: commit all the staged files.'
-    message = message or str(datetime.now())
-    ret_code, _, _ = run_git_command(git_repo, f'commit --allow-empty -m "bot: {message}"')
+    '''
+    git: commit all the staged files, via write-tree, commit-tree and update-ref instead of the
+    porcelain commit, so neither the work tree is scanned nor the hooks are run.
+    '''
+    message = f'bot: {message or datetime.now()}'
+    ret_code, tree, error = run_git_command(git_repo, ['write-tree'])
+
+    if ret_code != 0:
+        logger.error(f'Error: {error}')
+        return False
+
+    head = run_git_head(git_repo)
+    ret_code, commit, error = run_git_command(git_repo, ['commit-tree', tree.strip(), *(['-p', head] if head else []), '-F', '-'], input=message)
+
+    if ret_code != 0:
+        logger.error(f'Error: {error}')
+        return False
+
+    # Fail if HEAD moved meanwhile.
+    ret_code, _, error = run_git_command(git_repo, ['update-ref', '-m', f'commit: {message}', 'HEAD', commit.strip(), head or ''])
+    ret_code == 0 or logger.error(f'Error: {error}')
+    return ret_code == 0
+
+def run_git_head(git_repo):
+    'git: return the commit hash of HEAD.'
+    ret_code, output, _ = run_git_command(git_repo, ['rev-parse', '--verify', '-q', 'HEAD'])
+    return output.strip() if ret_code == 0 else None
+
+def run_git_worktree_add(git_repo, path, commit='HEAD'):
+    'git: check out the commit to a new detached worktree.'
+    ret_code, _, error = run_git_command(git_repo, ['worktree', 'add', '--force', '--detach', path, commit])
+    ret_code == 0 or logger.error(f'Error: {error}')
     return ret_code == 0
+
+def run_git_reset_hard(git_repo, commit='HEAD'):
+    'git: reset to the commit and drop all the staged and unstaged changes.'
+    ret_code, _, _ = run_git_command(git_repo, ['reset', '-q', '--hard', commit])
+    return ret_code == 0
+
+def run_git_worktree_reset(worktree, commit):
+    'git: reset the worktree to the commit and drop all the changes in it.'
+    ret_code, _, error = run_git_command(worktree, ['checkout', '-q', '--force', '--detach', commit])
+    ret_code == 0 or logger.error(f'Error: {error}')
+    return ret_code == 0 and run_git_reset_hard(worktree, commit)
@@ -0,0 +1,231 @@
+import os, os.path
+import json
+import time
+import stat
+import socket
+import hashlib
+import tempfile
+import threading
+import socketserver
+from symbols import *
+from graph import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Out of the package directory, the unix socket path is limited to about 100 bytes.
+SOCKET_DIR = os.path.join(tempfile.gettempdir(), f'code-analyzer-{os.getuid()}')
+CONNECT_TIMEOUT = 1
+
+def get_socket_path(project_path, socket_dir=None):
+    project_path = os.path.abspath(os.path.expanduser(project_path))
+    name = hashlib.sha1(project_path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(socket_dir or SOCKET_DIR, f'{name}.sock')
+
+def is_private_dir(dirpath):
+    'Whether the directory is owned by the current user with the mode 0700, so no one else could have placed a socket in it.'
+    try:
+        st = os.lstat(dirpath)
+    except OSError:
+        return False
+
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and stat.S_IMODE(st.st_mode) == 0o700
+
+def stat_files(filepaths):
+    'Return filepath -> (mtime, size) of the existing files.'
+    stats = {}
+
+    for filepath in filepaths:
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+
+        stats[filepath] = (stat.st_mtime_ns, stat.st_size)
+
+    return stats
+
+class ProjectState:
+    '''
+    The in-memory symbol index and header graph of the project, refreshed incrementally
+    by polling the mtimes of the source files.
+    '''
+
+    def __init__(self, project_path, cache=None, jobs=1):
+        self.project_path = os.path.abspath(os.path.expanduser(project_path))
+        self.cache = cache
+        self.jobs = jobs
+        self.lock = threading.RLock()
+        self.stats = {}
+        self.index = None
+        self.graph = None   # built lazily, dropped when any header is added or removed.
+
+    def get_source_files(self):
+        return [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(self.project_path)]
+
+    def load(self):
+        self.stats = stat_files(self.get_source_files())
+        self.index = SymbolIndex(self.project_path, cache=self.cache, jobs=self.jobs).build()
+        logger.info(f'Indexed {len(self.stats)} file(s) of {self.project_path}')
+        return self
+
+    def refresh(self):
+        'Re-scan the files changed, added or removed since the last refresh, return their count.'
+        stats = stat_files(self.get_source_files())
+        changed = [filepath for filepath, stat in stats.items() if self.stats.get(filepath) != stat]
+        removed = [filepath for filepath in self.stats if filepath not in stats]
+
+        if not changed and not removed:
+            return 0
+
+        with self.lock:
+            for filepath in removed:
+                self.index.remove_file(filepath)
+
+            for filepath in changed:
+                try:
+                    self.index.update_file(filepath)
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warning(f'Failed to scan {filepath}: {e}')
+                    stats.pop(filepath)
+                    continue
+
+                self.graph is not None and filepath in self.stats and self.graph.invalidate(filepath)
+
+            if any(filepath.endswith('.h') and filepath not in self.stats for filepath in changed) or any(filepath.endswith('.h') for filepath in removed):
+                self.graph = None
+
+            self.stats = stats
+
+        logger.info(f'Refreshed {len(changed)} changed and {len(removed)} removed file(s)')
+        return len(changed) + len(removed)
+
+    def poll(self, interval):
+        while True:
+            time.sleep(interval)
+
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Failed to refresh the index')
+
+    def get_header_tree(self, entry):
+        'Return [depth, header name] of the import tree from the entry header.'
+        if self.graph is None:
+            self.graph = HeaderGraph(cache=self.cache).add_project_headers(self.project_path, dir_filter=lambda dirname, dirpath: dirname not in ['lib', 'grpc', 'UBC'])
+
+        if not os.path.isabs(entry):
+            raise ValueError(f'The entry header must be an absolute path: {entry}')
+
+        # Each walk follows the edges not discovered before, start over.
+        self.graph.edges.clear()
+        self.graph.children.clear()
+        _, root_node = self.graph.get_or_create(os.path.basename(entry), dir=os.path.dirname(entry))
+        return [[depth, node.name] for depth, _, node in self.graph.walk(root_node)]
+
+    def query(self, command, **args):
+        'Answer the command with the JSON serializable result, the files changed since the last poll are re-scanned first.'
+        with self.lock:
+            command != 'ping' and self.refresh()
+
+            if command == 'ping':
+                return self.project_path
+            elif command == 'get-all-vcs':
+                return self.index.get_all_view_controllers()
+            elif command == 'get-all-classes':
+                return self.index.get_all_classes()
+            elif command == 'unused-imports':
+                # Relative to the project, the clients join them with the project path as they were given.
+                return [[symbol, os.path.relpath(filepath, self.project_path), results] for symbol, filepath, results in get_all_unused_code_import(self.project_path, index=self.index)]
+            elif command == 'header-tree':
+                return self.get_header_tree(args['entry'])
+
+        raise ValueError(f'Unknown command {command}')
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    'Answer the JSON line requests {"command", "args"} with JSON lines {"ok", "result" or "error"}.'
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+
+                if request['command'] == 'stop':
+                    threading.Thread(target=self.server.shutdown).start()
+                    response = {'ok': True, 'result': None}
+                else:
+                    response = {'ok': True, 'result': self.server.state.query(request['command'], **request.get('args', {}))}
+            except Exception as e:
+                logger.exception(f'Failed to answer {line!r}')
+                response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class ProjectServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, state):
+        self.state = state
+        super().__init__(socket_path, RequestHandler)
+
+def query_server(project_path, command, socket_dir=None, **args):
+    'Return the result of the command answered by the running server of the project, or None if no server is running.'
+    socket_path = get_socket_path(project_path, socket_dir=socket_dir)
+
+    if not os.path.exists(socket_path):
+        return None
+
+    if not is_private_dir(os.path.dirname(socket_path)):
+        logger.warning(f'Ignored the server socket {socket_path}, its directory is not private to the current user.')
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(CONNECT_TIMEOUT)
+            s.connect(socket_path)
+            # The queries like the unused imports may take a while.
+            s.settimeout(None)
+            s.sendall(json.dumps({'command': command, 'args': args}).encode('utf-8') + b'\n')
+
+            with s.makefile('rb') as f:
+                response = json.loads(f.readline())
+    except (OSError, ValueError) as e:
+        logger.debug(f'Server of {project_path} is unavailable: {e}')
+        return None
+
+    if not response['ok']:
+        logger.warning(f'Server failed to answer {command}: {response["error"]}')
+        return None
+
+    logger.debug(f'Answered {command} by the server {socket_path}')
+    return response['result']
+
+def serve(project_path, cache=None, jobs=1, interval=2.0, socket_dir=None):
+    'Serve the queries of the project over the unix socket until stopped.'
+    socket_path = get_socket_path(project_path, socket_dir=socket_dir)
+
+    if query_server(project_path, 'ping', socket_dir=socket_dir) is not None:
+        raise RuntimeError(f'Server of {project_path} is running already at {socket_path}')
+
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+
+    if not is_private_dir(os.path.dirname(socket_path)):
+        raise RuntimeError(f'The socket directory {os.path.dirname(socket_path)} must be owned by the current user with the mode 0700.')
+
+    try:
+        # Left by a crashed server.
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+
+    state = ProjectState(project_path, cache=cache, jobs=jobs).load()
+    threading.Thread(target=state.poll, args=(interval,), daemon=True).start()
+
+    with ProjectServer(socket_path, state) as server:
+        logger.info(f'Serving {state.project_path} at {socket_path}')
+
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
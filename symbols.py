@@ -1,18 +1,66 @@
 import re
+from functools import partial
 from files import *
+from lexer import *
+from instrument import span, increment, traced
+
+VIEW_CONTROLLER_REGEX = r'@interface\s+SRT\w+ViewController.*:.*SRTBaseViewController'
+CLASS_REGEX = r'@interface\s+\w+.*:.*\w+'
+IDENTIFIER_REGEX = re.compile(r'\w+', flags=re.U)
+HEADER_IMPORT_REGEX = r'^\s*#import\s+["<].*\.h[">]'
+HEADER_IMPORT_BYTES_REGEX = re.compile(HEADER_IMPORT_REGEX.encode('utf-8'), flags=re.M)
+
+def get_interface_name(definition):
+    'Return the class name from the @interface declaration.'
+    units = re.split('@interface|:', definition)
+    return units[1].lstrip().rstrip()
+
+def get_import_header_name(statement):
+    'Return the header filename from the #import statement.'
+    units = re.split('"|<|>|/', statement)
+    del units[0], units[-1]
+    return units[-1]
+
+@traced('symbols.scan')
+def scan_source(content):
+    'Extract all the declarations, identifiers and imports from the source content.'
+    return {
+        'classes': list(map(get_interface_name, re.findall(CLASS_REGEX, content, flags=re.M|re.U))),
+        'view_controllers': list(map(get_interface_name, re.findall(VIEW_CONTROLLER_REGEX, content, flags=re.M|re.U))),
+        'identifiers': sorted(set(IDENTIFIER_REGEX.findall(content))),
+        'imports': list(map(get_import_header_name, re.findall(HEADER_IMPORT_REGEX, content, flags=re.M|re.U))),
+    }
 
 def search_file_with_regex(regex, filepath):
-    'Search regex in specified file content.'
+    'Search regex in specified file content, the file is memory mapped instead of read as a whole.'
+    with span('symbols.regex'):
+        results = list(iter_file_matches(re.compile(regex.encode('utf-8'), flags=re.M), filepath))
+
+    increment('regex.matches', len(results))
+    return results
+
+def search_file_lines_with_regex(regex, filepath):
+    'Return the (line number, line, match) of the regex matches in the specified file.'
+    with span('symbols.regex'):
+        results = list(iter_file_matches(re.compile(regex.encode('utf-8'), flags=re.M), filepath, with_lines=True))
+
+    increment('regex.matches', len(results))
+    return results
+
+def scan_source_file(filepath):
+    'Return the source lines and the scanning result of the specified file.'
     with open(filepath, 'r') as f:
         content = f.read()
-        return re.findall(regex, content, flags=re.M|re.U)
 
-def search_target_in_project(regex, project_path, flat=True, mapper=None):
+    increment('files.bytes_read', len(content))
+    return content.split('\n'), scan_source(content)
+
+def search_target_in_project(regex, project_path, flat=True, mapper=None, jobs=1):
     'Search regex in all the source file under the specified project path.'
-    for dirpath, filename in find_source_files(project_path):
-        filepath = os.path.join(dirpath, filename)
-        results = search_file_with_regex(regex, filepath)
+    filepaths = [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(project_path)]
+    search = partial(search_file_with_regex, regex)
 
+    for filepath, results in zip(filepaths, map_files(search, filepaths, jobs=jobs)):
         if len(results) <= 0:
             continue
 
@@ -22,91 +70,262 @@ def search_target_in_project(regex, project_path, flat=True, mapper=None):
         else:
             yield (filepath, list(map(mapper, results) if mapper else results))
 
-def search_all_view_controllers(project_path, flat=True):
+def search_all_view_controllers(project_path, flat=True, jobs=1):
     'Search all the view controllers\' usages under the project.'
-    regex = r'@interface\s+SRT\w+ViewController.*:.*SRTBaseViewController'
-
-    def get_vc_name(definition):
-        units = re.split('@interface|:', definition)
-        return units[1].lstrip().rstrip()
+    return search_target_in_project(VIEW_CONTROLLER_REGEX, project_path, flat, mapper=get_interface_name, jobs=jobs)
 
-    return search_target_in_project(regex, project_path, flat, mapper=get_vc_name)
-
-def get_all_view_controllers(project_path):
+@traced('symbols.view_controllers')
+def get_all_view_controllers(project_path, cache=None, jobs=1):
     'Return all the unique view controller names under the project.'
+    if cache is not None:
+        return SymbolIndex(project_path, cache=cache, jobs=jobs).build().get_all_view_controllers()
+
     all_vcs = list()
 
-    for _, results in search_all_view_controllers(project_path, flat=False):
+    for _, results in search_all_view_controllers(project_path, flat=False, jobs=jobs):
         all_vcs.extend(results)
 
     return sorted(list(set(all_vcs)))
 
-def search_all_classes(project_path):
-    'Search all the class\' usages under the project.'
-    regex = r'@interface\s+\w+.*:.*\w+'
+def iter_declarations(regex, project_path, key, cache=None, jobs=1):
+    '''
+    Yield (name, filepath, line number, line) of the declarations matching regex, file by file as they are scanned.
+    With the cache, only the files whose cached scanning result has any declaration of the key are searched for the lines.
+    '''
+    filepaths = [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(project_path)]
+
+    if cache is not None:
+        cache.prefetch(filepaths, scan_source, jobs=jobs)
+        filepaths = [filepath for filepath in filepaths if cache.get(filepath, scan_source)[key]]
 
-    def get_class_name(definition):
-        units = re.split('@interface|:', definition)
-        return units[1].lstrip().rstrip()
+    for filepath, results in zip(filepaths, map_files(partial(search_file_lines_with_regex, regex), filepaths, jobs=jobs)):
+        for lineno, line, definition in results:
+            yield get_interface_name(definition), filepath, lineno, line
 
-    return search_target_in_project(regex, project_path, False, mapper=get_class_name)
+def iter_view_controllers(project_path, cache=None, jobs=1):
+    return iter_declarations(VIEW_CONTROLLER_REGEX, project_path, 'view_controllers', cache=cache, jobs=jobs)
 
-def get_all_classes(project_path):
+def iter_classes(project_path, cache=None, jobs=1):
+    return iter_declarations(CLASS_REGEX, project_path, 'classes', cache=cache, jobs=jobs)
+
+def search_all_classes(project_path, jobs=1):
+    'Search all the class\' usages under the project.'
+    return search_target_in_project(CLASS_REGEX, project_path, False, mapper=get_interface_name, jobs=jobs)
+
+def get_all_classes(project_path, cache=None, jobs=1):
     'Return all the unique class names under the project.'
+    if cache is not None:
+        return SymbolIndex(project_path, cache=cache, jobs=jobs).build().get_all_classes()
+
     all_classes = list()
 
-    for _, results in search_all_classes(project_path):
+    for _, results in search_all_classes(project_path, jobs=jobs):
         all_classes.extend(results)
 
     return sorted(list(set(all_classes)))
 
 
-def is_code_import(content):
-    'Whether the source content is a #import "" or #import <>.'
-    return re.match(r'#import.*[<"]\w+\.h[<"]', content, flags=re.M) is not None
+class SymbolIndex:
+    '''
+    Inverted index of identifier -> files -> matching lines, built in one pass over the project.
+    With a fresh compact index of the project, the files are not scanned at all, the referrers and
+    declarations are looked up in it, until any file is updated.
+    '''
 
-def is_code_single_line_comment(content):
-    'Whether the source content is a single line comment likes //'
-    return re.match(r'^\s*//.*', content, flags=re.M) is not None
+    def __init__(self, project_path, cache=None, jobs=1, compact=None):
+        self.project_path = project_path
+        self.cache = cache
+        self.jobs = jobs
+        self.compact = compact
+        self.files = {}             # filepath -> source lines, loaded lazily on cache hits.
+        self.occurrences = {}       # filepath -> {identifier: [(line number, token class)]}, lexed lazily.
+        self.order = {}             # filepath -> scanning order, keeps the results deterministic.
+        self.identifiers = {}       # filepath -> referenced identifiers.
+        self.postings = {}          # identifier -> {filepath: None}, an ordered set of files.
+        self.classes = {}           # filepath -> declared class names.
+        self.view_controllers = {}  # filepath -> declared view controller names.
 
+    @traced('symbols.index')
+    def build(self):
+        'Scan all the source files under the project once.'
+        if self.compact is not None:
+            return self
 
-def get_unused_symbol_code_import(symbol_name, project_path):
-    'Return the specified symbol\'s import and comment usages under the project.'
-    regex = r'^.*%s.*$' % symbol_name
+        filepaths = [os.path.join(dirpath, filename) for dirpath, filename in find_source_files(self.project_path)]
+
+        if self.cache is not None:
+            self.cache.prefetch(filepaths, scan_source, jobs=self.jobs)
+
+            for filepath in filepaths:
+                self.add_file(filepath, self.cache.get(filepath, scan_source))
+        else:
+            for filepath, (lines, record) in zip(filepaths, map_files(scan_source_file, filepaths, jobs=self.jobs)):
+                self.add_file(filepath, record, lines)
+
+        return self
+
+    def update_file(self, filepath):
+        'Re-scan the specified file, call it after the file content changed.'
+        if self.compact is not None:
+            # The compact index is read-only, scan the whole project from now on.
+            self.compact = None
+            self.build()
+            return
+
+        self.remove_file(filepath)
+
+        if self.cache is not None:
+            self.add_file(filepath, self.cache.get(filepath, scan_source))
+        else:
+            lines, record = scan_source_file(filepath)
+            self.add_file(filepath, record, lines)
+
+    def add_file(self, filepath, record, lines=None):
+        'Index the scanning result of the specified file.'
+        if lines is not None:
+            self.files[filepath] = lines
+
+        self.order.setdefault(filepath, len(self.order))
+        self.identifiers[filepath] = record['identifiers']
+
+        for identifier in record['identifiers']:
+            self.postings.setdefault(identifier, {})[filepath] = None
+
+        self.classes[filepath] = record['classes']
+        self.view_controllers[filepath] = record['view_controllers']
 
-    for filepath, results in search_target_in_project(regex, project_path, flat=False):
+    def remove_file(self, filepath):
+        'Drop all the indexed content of the specified file.'
+        for identifier in self.identifiers.pop(filepath, []):
+            files = self.postings.get(identifier)
+
+            if files is not None:
+                files.pop(filepath, None)
+                files or self.postings.pop(identifier)
+
+        self.files.pop(filepath, None)
+        self.occurrences.pop(filepath, None)
+        self.classes.pop(filepath, None)
+        self.view_controllers.pop(filepath, None)
+
+    def get_lines(self, filepath):
+        'Return the source lines of the indexed file.'
+        lines = self.files.get(filepath)
+
+        if lines is None:
+            with open(filepath, 'r') as f:
+                lines = self.files[filepath] = f.read().split('\n')
+
+        return lines
+
+    def get_occurrences(self, filepath):
+        'Return the identifier occurrences with their token classes of the indexed file.'
+        occurrences = self.occurrences.get(filepath)
+
+        if occurrences is None:
+            occurrences = self.occurrences[filepath] = get_occurrences('\n'.join(self.get_lines(filepath)))
+
+        return occurrences
+
+    def get_referrers(self, symbol_name):
+        'Return the files which reference the specified identifier, in the scanning order.'
+        if self.compact is not None:
+            return [os.path.join(self.project_path, os.path.relpath(filepath, self.compact.project_path)) for filepath in self.compact.get_referrers(symbol_name)]
+
+        return sorted(self.postings.get(symbol_name, {}), key=self.order.get)
+
+    def search_usages(self, symbol_name):
+        'Yield the files and their (line number, line, token classes) which reference the specified identifier.'
+        for filepath in self.get_referrers(symbol_name):
+            usages = {}
+
+            for lineno, kind in self.get_occurrences(filepath).get(symbol_name, []):
+                usages.setdefault(lineno, set()).add(kind)
+
+            if usages:
+                lines = self.get_lines(filepath)
+                yield (filepath, [(lineno, lines[lineno], kinds) for lineno, kinds in usages.items()])
+
+    def search_symbol(self, symbol_name):
+        'Yield the files and their lines which reference the specified identifier.'
+        for filepath, usages in self.search_usages(symbol_name):
+            yield (filepath, [line for _, line, _ in usages])
+
+    def get_all_view_controllers(self):
+        'Return all the unique view controller names in the index.'
+        if self.compact is not None:
+            return self.compact.get_all_view_controllers()
+
+        return sorted(set(vc for vcs in self.view_controllers.values() for vc in vcs))
+
+    def get_all_classes(self):
+        'Return all the unique class names in the index.'
+        if self.compact is not None:
+            return self.compact.get_all_classes()
+
+        return sorted(set(c for classes in self.classes.values() for c in classes))
+
+
+def is_code_import(kinds):
+    'Whether the symbol usage is in a #import "" or #import <> only.'
+    return IMPORT in kinds and kinds <= {IMPORT, LINE_COMMENT, BLOCK_COMMENT}
+
+def is_code_comment(kinds):
+    'Whether the symbol usage is in the // or /* */ comments only.'
+    return kinds <= {LINE_COMMENT, BLOCK_COMMENT}
+
+
+def search_unused_symbol_usages(symbol_name, project_path, index=None):
+    '''
+    Return the files in which the specified symbol is only imported or mentioned in comments,
+    with their (line number, line, token classes) usages.
+    '''
+    index = index or SymbolIndex(project_path).build()
+
+    for filepath, usages in index.search_usages(symbol_name):
         if symbol_name in filepath:
             # Skip the symbol file itself.
             continue
 
         is_unused = True
 
-        for result in results:
-            is_unused &= is_code_import(result) or is_code_single_line_comment(result)
+        for _, _, kinds in usages:
+            is_unused &= is_code_import(kinds) or is_code_comment(kinds)
 
         if is_unused:
-            yield (filepath, results)
+            yield (filepath, usages)
+
+def get_usage_classification(kinds):
+    'Return how the unused symbol is referenced in the line, import or comment.'
+    return 'import' if is_code_import(kinds) else 'comment'
+
+def get_unused_symbol_code_import(symbol_name, project_path, index=None):
+    'Return the specified symbol\'s import and comment usages under the project.'
+    for filepath, usages in search_unused_symbol_usages(symbol_name, project_path, index=index):
+        yield (filepath, [line for _, line, _ in usages])
 
-def get_all_unused_code_import(project_path):
+def get_all_unused_code_import(project_path, cache=None, jobs=1, index=None):
     'Return all the unused import or comment view controller usages under the project'
-    for symbol in get_all_view_controllers(project_path):
-        for filepath, results in get_unused_symbol_code_import(symbol, project_path):
-            yield (symbol, filepath, results)
+    index = index or SymbolIndex(project_path, cache=cache, jobs=jobs).build()
 
-def get_all_header_imports(header_path):
+    for symbol in index.get_all_view_controllers():
+        for filepath, results in get_unused_symbol_code_import(symbol, project_path, index=index):
+            yield (symbol, filepath, results)
 
-    headers = []
-    regex = r'^\s*#import\s+["<].*\.h[">]'
+def iter_unused_code_import_usages(project_path, cache=None, jobs=1, index=None):
+    'Yield (symbol, filepath, line number, line, classification) of all the unused view controller usages.'
+    index = index or SymbolIndex(project_path, cache=cache, jobs=jobs).build()
 
-    with open(header_path, 'r') as f:
-        content = f.read()
-        headers = re.findall(regex, content, flags=re.M|re.U)
+    for symbol in index.get_all_view_controllers():
+        for filepath, usages in search_unused_symbol_usages(symbol, project_path, index=index):
+            for lineno, line, kinds in usages:
+                yield (symbol, filepath, lineno, line, get_usage_classification(kinds))
 
-    def format(content):
-        units = re.split('"|<|>|/', content)
-        del units[0], units[-1]
-        # print(f'{content} -> {units}')
-        return units[-1]
+def get_all_header_imports(header_path, cache=None):
+    'Return all the imported header names in the specified header file.'
+    if cache is not None:
+        return cache.get(header_path, scan_source)['imports']
 
-    headers = list(map(format, headers))
-    return headers
+    # All the imports like scan_source does, the ones after @end are common too.
+    headers = iter_file_matches(HEADER_IMPORT_BYTES_REGEX, header_path)
+    return list(map(get_import_header_name, headers))
@@ -0,0 +1,121 @@
+import os, os.path
+import random
+import subprocess
+
+import logging
+logger = logging.getLogger(__name__)
+
+BASE_VIEW_CONTROLLER = 'SRTBaseViewController'
+PREFIX_HEADER = 'Prefix.pch'
+# Files per module directory, like the feature folders of a real project.
+MODULE_SIZE = 100
+
+class SyntheticProject:
+    '''
+    Deterministic fake Objective-C project, the same parameters and seed always write the same files.
+    Each unit is a header + implementation pair of one class, a view_controller_ratio of them are
+    SRT*ViewController subclasses of SRTBaseViewController. The headers are laid out in depth layers,
+    each imports fanout headers of the deeper layers, plus cycles back edges to the shallower layers.
+    The prefix header imports the first layer as the header graph entry.
+    '''
+
+    def __init__(self, files=1000, fanout=4, depth=8, cycles=4, view_controller_ratio=0.2, unused_ratio=0.1, large_files=2, large_lines=20000, seed=0):
+        self.units = max(1, files // 2)
+        self.fanout = fanout
+        self.depth = max(1, depth)
+        self.cycles = cycles
+        self.view_controller_ratio = view_controller_ratio
+        self.unused_ratio = unused_ratio
+        self.large_files = large_files
+        self.large_lines = large_lines
+        self.seed = seed
+
+    def __repr__(self):
+        return f'<SyntheticProject: {self.units} units, fanout {self.fanout}, depth {self.depth}, seed {self.seed}>'
+
+    def get_class_name(self, index):
+        step = round(1 / self.view_controller_ratio) if self.view_controller_ratio > 0 else 0
+        return f'SRTItem{index}ViewController' if step and index % step == 0 else f'SRTModel{index}'
+
+    def get_layer(self, index):
+        return index * self.depth // self.units
+
+    def get_dir(self, index):
+        return os.path.join('Sources', f'Module{index // MODULE_SIZE}')
+
+    def get_imports(self, rng):
+        'Return unit index -> the unit indexes its header imports.'
+        layers = [[] for _ in range(self.depth)]
+
+        for index in range(self.units):
+            layers[self.get_layer(index)].append(index)
+
+        imports = {}
+
+        for index in range(self.units):
+            deeper = [layer for layer in layers[self.get_layer(index) + 1:] if layer]
+            imports[index] = sorted(set(rng.choice(rng.choice(deeper[:2])) for _ in range(self.fanout))) if deeper else []
+
+        # The back edges from the deepest layer close the import cycles.
+        for _ in range(self.cycles if self.depth > 1 else 0):
+            source, target = rng.choice(layers[-1] or [0]), rng.choice(layers[0])
+            source != target and target not in imports[source] and imports[source].append(target)
+
+        return imports
+
+    def write(self, path, git=False):
+        'Write the project files under the path, commit them into a new git repository if git.'
+        rng = random.Random(self.seed)
+        imports = self.get_imports(rng)
+        files = {}
+
+        files[f'{BASE_VIEW_CONTROLLER}.h'] = f'#import <UIKit/UIKit.h>\n\n@interface {BASE_VIEW_CONTROLLER} : UIViewController\n\n@end\n'
+        files[f'{BASE_VIEW_CONTROLLER}.m'] = f'#import "{BASE_VIEW_CONTROLLER}.h"\n\n@implementation {BASE_VIEW_CONTROLLER}\n\n@end\n'
+        files[PREFIX_HEADER] = ''.join(f'#import "{self.get_class_name(index)}.h"\n' for index in range(self.units) if self.get_layer(index) == 0)
+
+        for index in range(self.units):
+            name = self.get_class_name(index)
+            base = BASE_VIEW_CONTROLLER if name.endswith('ViewController') else 'NSObject'
+            dirpath = self.get_dir(index)
+            imported = [self.get_class_name(sub_index) for sub_index in imports[index]]
+            header_imports = ''.join(f'#import "{sub_name}.h"\n' for sub_name in imported)
+            base_import = f'#import "{BASE_VIEW_CONTROLLER}.h"\n' if base == BASE_VIEW_CONTROLLER else '#import <Foundation/Foundation.h>\n'
+            properties = ''.join(f'@property (nonatomic, strong) {sub_name} *item{i};\n' for i, sub_name in enumerate(imported))
+            files[os.path.join(dirpath, f'{name}.h')] = f'{base_import}{header_imports}\n@interface {name} : {base}\n\n{properties}\n- (void)update{index};\n\n@end\n'
+
+            # The implementation uses a few classes, and imports some only in the import line or a comment.
+            used = [self.get_class_name(rng.randrange(self.units)) for _ in range(self.fanout)]
+            unused = [self.get_class_name(rng.randrange(self.units)) for _ in range(self.fanout) if rng.random() < self.unused_ratio]
+            source_imports = ''.join(f'#import "{sub_name}.h"\n' for sub_name in dict.fromkeys([name] + used + unused))
+            body = ''.join(f'    {sub_name} *object{i} = [[{sub_name} alloc] init];\n    [object{i} description];\n' for i, sub_name in enumerate(used))
+            comments = ''.join(f'    // {sub_name} is kept for the next release.\n' for sub_name in unused[:1])
+            files[os.path.join(dirpath, f'{name}.m')] = f'{source_imports}\n@implementation {name}\n\n- (void)update{index} {{\n{body}{comments}}}\n\n@end\n'
+
+        for index in range(self.large_files):
+            name = f'SRTGenerated{index}'
+            methods = ''.join(f'- (NSInteger)value{i} {{\n    return {rng.randrange(1 << 30)};\n}}\n\n' for i in range(self.large_lines // 4))
+            files[os.path.join('Generated', f'{name}.h')] = f'#import <Foundation/Foundation.h>\n\n@interface {name} : NSObject\n\n@end\n'
+            files[os.path.join('Generated', f'{name}.m')] = f'#import "{name}.h"\n\n@implementation {name}\n\n{methods}@end\n'
+
+        for relpath, content in files.items():
+            filepath = os.path.join(path, relpath)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+            with open(filepath, 'w') as f:
+                f.write(content)
+
+        logger.debug(f'Wrote {len(files)} file(s) of {self} to {path}')
+        git and commit_project(path)
+        return path
+
+def commit_project(path):
+    'Commit all the files into a new git repository, with a fixed identity and date to keep the commit deterministic.'
+    env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost', GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost',
+               GIT_AUTHOR_DATE='2000-01-01T00:00:00Z', GIT_COMMITTER_DATE='2000-01-01T00:00:00Z')
+
+    for args in (['init', '-q'], ['add', '-A'], ['commit', '-q', '-m', 'Initial commit']):
+        subprocess.run(['git', *args], cwd=path, env=env, check=True, stdout=subprocess.DEVNULL)
+
+def generate_project(path, git=False, **kwargs):
+    'Write the synthetic project with the parameters of SyntheticProject, return the path.'
+    return SyntheticProject(**kwargs).write(path, git=git)
@@ -0,0 +1,75 @@
+import os.path
+import pytest
+from analyze import build_header_graph
+from compact import CompactIndex, write_compact_index
+from symbols import SymbolIndex, get_all_unused_code_import
+from synthetic import PREFIX_HEADER, SyntheticProject
+
+@pytest.fixture
+def project(tmp_path):
+    return SyntheticProject(files=40, large_files=0, seed=1).write(str(tmp_path / 'project'))
+
+@pytest.fixture
+def index_path(tmp_path, project):
+    return write_compact_index(project, path=str(tmp_path / 'index.bin'))
+
+def test_open_index(project, index_path):
+    index = CompactIndex.open(project, index_path)
+
+    assert index is not None and index.is_fresh()
+    assert 'SRTItem0ViewController' in index.get_all_view_controllers()
+    index.close()
+
+@pytest.fixture
+def compact(project, index_path):
+    index = CompactIndex.open(project, index_path)
+    yield index
+    index.close()
+
+def test_symbol_index_uses_compact(project, compact):
+    scanned = SymbolIndex(project).build()
+    indexed = SymbolIndex(project, compact=compact).build()
+
+    assert not indexed.postings
+    assert indexed.get_all_classes() == scanned.get_all_classes()
+    assert indexed.get_all_view_controllers() == scanned.get_all_view_controllers()
+    assert sorted(get_all_unused_code_import(project, index=indexed)) == sorted(get_all_unused_code_import(project, index=scanned))
+
+def test_symbol_index_detaches_compact_on_update(project, compact):
+    index = SymbolIndex(project, compact=compact).build()
+    filepath = os.path.join(project, 'SRTBaseViewController.h')
+
+    with open(filepath, 'a') as f:
+        f.write('\n@interface SRTExtraViewController : SRTBaseViewController\n@end\n')
+
+    index.update_file(filepath)
+
+    assert index.compact is None
+    assert 'SRTExtraViewController' in index.get_all_view_controllers()
+
+def test_header_graph_uses_compact(project, compact):
+    def get_edges(compact):
+        graph, root_node = build_header_graph(project, os.path.join(project, PREFIX_HEADER), compact=compact)
+        return [(node.fullpath, sub_node.name) for _, node, sub_node in graph.walk(root_node) if node]
+
+    edges = get_edges(compact)
+
+    assert edges and edges == get_edges(None)
+
+@pytest.mark.parametrize('size', [0, 10, 100, 1000, -1])
+def test_truncated_index_is_ignored(project, index_path, size):
+    with open(index_path, 'rb') as f:
+        data = f.read()
+
+    with open(index_path, 'wb') as f:
+        f.write(data[:size])
+
+    assert CompactIndex.open(project, index_path) is None
+
+def test_corrupt_section_table_is_ignored(project, index_path):
+    with open(index_path, 'r+b') as f:
+        # The typecode of the first section.
+        f.seek(16 + 32)
+        f.write(b'?')
+
+    assert CompactIndex.open(project, index_path) is None
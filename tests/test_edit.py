@@ -0,0 +1,61 @@
+import os
+from edit import EditTransaction, find_line, remove_lines
+
+LINES = [b'#import "A.h"\n', b'#import "B.h"\n', b'#import "A.h"\n', b'\n', b'@implementation Foo\n']
+
+def test_find_line_at_line_number():
+    assert find_line(LINES, 1, '#import "B.h"', set()) == 1
+
+def test_find_line_nearest_after_shift():
+    assert find_line(LINES, 3, '#import "B.h"', set()) == 1
+    assert find_line(LINES, 3, '#import "A.h"', set()) == 2
+
+def test_find_line_skips_claimed_duplicates():
+    assert find_line(LINES, 0, '#import "A.h"', {0}) == 2
+    assert find_line(LINES, 0, '#import "A.h"', {0, 2}) is None
+
+def test_find_line_gone():
+    assert find_line(LINES, 1, '#import "C.h"', set()) is None
+
+def write(tmp_path, name, data):
+    filepath = tmp_path / name
+    filepath.write_bytes(data)
+    return str(filepath)
+
+def test_apply_removes_duplicate_lines_once_each(tmp_path):
+    filepath = write(tmp_path, 'Foo.m', b''.join(LINES))
+    applied = remove_lines([(filepath, 0, '#import "A.h"'), (filepath, 0, '#import "A.h"'), (filepath, 1, '#import "C.h"')])
+
+    assert applied == [(filepath, 0, '#import "A.h"'), (filepath, 0, '#import "A.h"')]
+    assert open(filepath, 'rb').read() == b'#import "B.h"\n\n@implementation Foo\n'
+
+def test_apply_relocates_shifted_line(tmp_path):
+    filepath = write(tmp_path, 'Foo.m', b'// header\n' + b''.join(LINES))
+    transaction = EditTransaction()
+    transaction.remove_line(filepath, 1, '#import "B.h"')
+
+    assert transaction.apply() == [(filepath, 1, '#import "B.h"')]
+    assert b'B.h' not in open(filepath, 'rb').read()
+
+def test_rollback_restores_changed_files_only(tmp_path):
+    changed = write(tmp_path, 'Foo.m', b''.join(LINES))
+    unchanged = write(tmp_path, 'Bar.m', b''.join(LINES))
+    os.utime(unchanged, ns=(0, 0))
+    transaction = EditTransaction()
+    transaction.capture(unchanged)
+    transaction.remove_line(changed, 1, '#import "B.h"')
+    transaction.apply()
+    transaction.rollback()
+
+    assert open(changed, 'rb').read() == b''.join(LINES)
+    assert os.stat(unchanged).st_mtime_ns == 0
+
+def test_rollback_keeps_file_mode(tmp_path):
+    filepath = write(tmp_path, 'Foo.m', b''.join(LINES))
+    os.chmod(filepath, 0o640)
+    transaction = EditTransaction()
+    transaction.remove_line(filepath, 1, '#import "B.h"')
+    transaction.apply()
+    transaction.rollback()
+
+    assert os.stat(filepath).st_mode & 0o777 == 0o640
@@ -0,0 +1,57 @@
+import os
+import pytest
+from files import IgnoreMatcher, walk_files
+
+@pytest.fixture
+def matcher():
+    return IgnoreMatcher.for_project('/nonexistent')
+
+@pytest.mark.parametrize('relpath', ['App/libextras', 'App/builders', 'Source/Podspecs', 'App/grpcstuff', 'library', 'Pods.old'])
+def test_default_patterns_match_whole_names(matcher, relpath):
+    assert not matcher.is_ignored(relpath, True)
+
+@pytest.mark.parametrize('relpath', ['lib', 'App/lib', 'Pods', 'App/grpc', 'build', 'App/Assets.xcassets', 'App.xcodeproj'])
+def test_default_patterns(matcher, relpath):
+    assert matcher.is_ignored(relpath, True)
+
+def test_dir_only_pattern():
+    matcher = IgnoreMatcher(['build/'])
+
+    assert matcher.is_ignored('App/build', True)
+    assert not matcher.is_ignored('App/build')
+
+def test_negation():
+    matcher = IgnoreMatcher(['*.h', '!Keep.h', 'Generated/'])
+
+    assert matcher.is_ignored('App/Foo.h')
+    assert not matcher.is_ignored('App/Keep.h')
+    assert not matcher.is_ignored('App/Keep.hh')
+    assert matcher.is_ignored('Generated', True)
+
+def test_negation_in_nested_matcher():
+    matcher = IgnoreMatcher(['!Keep.h'], base='App', parent=IgnoreMatcher(['*.h']))
+
+    assert not matcher.is_ignored('App/Keep.h')
+    assert matcher.is_ignored('Other/Keep.h')
+    assert matcher.is_ignored('App/Foo.h')
+
+def test_nested_gitignore(tmp_path):
+    files = {
+        'App/Foo.h': '',
+        'App/libextras/Bar.h': '',
+        'App/lib/Skipped.h': '',
+        'App/Sub/.gitignore': 'Local.h\n/Anchored.h\n',
+        'App/Sub/Local.h': '',
+        'App/Sub/Anchored.h': '',
+        'App/Sub/Deep/Anchored.h': '',
+        'Local.h': '',
+    }
+
+    for relpath, content in files.items():
+        filepath = tmp_path / relpath
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_text(content)
+
+    found = sorted(os.path.relpath(os.path.join(root, name), tmp_path) for root, name in walk_files(str(tmp_path), file_filter=lambda name, root: name.endswith('.h'), ignore=IgnoreMatcher.for_project(str(tmp_path))))
+
+    assert found == ['App/Foo.h', 'App/Sub/Deep/Anchored.h', 'App/libextras/Bar.h', 'Local.h']
@@ -0,0 +1,36 @@
+import os.path
+import sys
+import subprocess
+from time import perf_counter
+from conftest import ROOT_DIR
+
+MAIN_SCRIPT = os.path.join(ROOT_DIR, 'main.py')
+# The modules only the commands need, importing any of them for --help slows down every invocation.
+HEAVY_MODULES = ['symbols', 'analyze', 'run', 'build', 'graph', 'compact', 'server', 'coloredlogs']
+# Seconds --help may take on top of a bare interpreter start.
+HELP_BUDGET = 0.08
+
+def run_python(*args):
+    'Run the interpreter in the repo root, return its wall seconds.'
+    start = perf_counter()
+    subprocess.run([sys.executable, *args], cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL)
+    return perf_counter() - start
+
+def test_help_imports_no_command_modules():
+    code = (
+        'import sys, runpy\n'
+        f'sys.argv = [{MAIN_SCRIPT!r}, "--help"]\n'
+        'try:\n'
+        f'    runpy.run_path({MAIN_SCRIPT!r}, run_name="__main__")\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        f'print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules), file=sys.stderr)\n'
+    )
+    p = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    assert p.stderr.strip() == ''
+
+def test_help_startup_time():
+    # The fastest of several runs, the slower ones measure the machine noise.
+    baseline = min(run_python('-c', 'pass') for _ in range(5))
+    elapsed = min(run_python(MAIN_SCRIPT, '--help') for _ in range(5))
+    assert elapsed - baseline < HELP_BUDGET
@@ -0,0 +1,37 @@
+import os
+from server import ProjectState, get_socket_path, is_private_dir, query_server
+
+def test_private_dir(tmp_path):
+    dirpath = tmp_path / 'sockets'
+    dirpath.mkdir(mode=0o700)
+
+    assert is_private_dir(str(dirpath))
+
+    dirpath.chmod(0o755)
+
+    assert not is_private_dir(str(dirpath))
+    assert not is_private_dir(str(tmp_path / 'missing'))
+
+def test_socket_in_shared_dir_is_ignored(tmp_path):
+    socket_dir = tmp_path / 'sockets'
+    socket_dir.mkdir(mode=0o777)
+    socket_dir.chmod(0o777)
+    project = tmp_path / 'project'
+    project.mkdir()
+    # Any file at the socket path, the client must not even connect to it.
+    open(get_socket_path(str(project), socket_dir=str(socket_dir)), 'w').close()
+
+    assert query_server(str(project), 'ping', socket_dir=str(socket_dir)) is None
+
+def test_query_refreshes_changed_files(tmp_path):
+    filepath = tmp_path / 'Foo.h'
+    filepath.write_text('@interface Foo : NSObject\n@end\n')
+    state = ProjectState(str(tmp_path)).load()
+
+    assert state.query('get-all-classes') == ['Foo']
+
+    filepath.write_text('@interface Foo : NSObject\n@end\n\n@interface Bar : NSObject\n@end\n')
+    # Not the same mtime and size even on the coarse file systems.
+    os.utime(filepath, ns=(0, 0))
+
+    assert state.query('get-all-classes') == ['Bar', 'Foo']
@@ -0,0 +1,12 @@
+from cache import ScanCache
+from symbols import get_all_header_imports
+
+HEADER = '#import "B.h"\n\n@interface A : NSObject\n@end\n\n#import "C.h"\n'
+
+def test_header_imports_after_interface(tmp_path):
+    filepath = tmp_path / 'A.h'
+    filepath.write_text(HEADER)
+    cache = ScanCache(str(tmp_path), cache_dir=str(tmp_path / 'cache'))
+
+    assert get_all_header_imports(str(filepath)) == ['B.h', 'C.h']
+    assert get_all_header_imports(str(filepath), cache=cache) == ['B.h', 'C.h']